@@ -0,0 +1,275 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+def metadata_terms(metadata: dict) -> set[str]:
+    """Returns lowercase words of the query, tags and colors of the image."""
+    text = " ".join(
+        [
+            metadata.get("query") or "",
+            *metadata.get("tags", []),
+            *metadata.get("colors", []),
+        ]
+    )
+    return set(re.findall(r"\w+", text.lower()))
+
+
+class ImageCache:
+    """Index of images in the download directory keyed by URL and content hash."""
+
+    def __init__(self, index_filename: str):
+        self.index_filename = os.path.expanduser(index_filename)
+        os.makedirs(os.path.dirname(self.index_filename), exist_ok=True)
+
+        # Connection is shared between worker threads, access is serialized
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.index_filename, check_same_thread=False
+        )
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+                url TEXT PRIMARY KEY,
+                content_hash TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                metadata TEXT NOT NULL DEFAULT '{}'
+            );
+            CREATE INDEX IF NOT EXISTS images_content_hash ON images (content_hash);
+            CREATE INDEX IF NOT EXISTS images_last_used ON images (last_used);
+            CREATE TABLE IF NOT EXISTS image_terms (
+                term TEXT NOT NULL,
+                path TEXT NOT NULL,
+                PRIMARY KEY (term, path)
+            );
+            CREATE INDEX IF NOT EXISTS image_terms_path ON image_terms (path);
+            CREATE TABLE IF NOT EXISTS searches (
+                key TEXT PRIMARY KEY,
+                etag TEXT,
+                fetched REAL NOT NULL,
+                results TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            """
+        )
+
+        # Index words of images downloaded before their terms were kept
+        rows = self._connection.execute(
+            "SELECT path, metadata FROM images"
+            " WHERE path NOT IN (SELECT path FROM image_terms)"
+        ).fetchall()
+        self._connection.executemany(
+            "INSERT OR IGNORE INTO image_terms (term, path) VALUES (?, ?)",
+            [
+                (term, path)
+                for path, metadata in rows
+                for term in metadata_terms(json.loads(metadata))
+            ],
+        )
+        self._connection.commit()
+
+    @contextmanager
+    def transaction(self):
+        """Yields the shared connection under the lock, committing on success."""
+        # Other indexes use it instead of competing for the write lock
+        with self._lock:
+            try:
+                yield self._connection
+            except BaseException:
+                self._connection.rollback()
+                raise
+            self._connection.commit()
+
+    def lookup(self, url: str) -> str | None:
+        """Returns local path of the image downloaded from url, None if not cached."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT path FROM images WHERE url = ?", (url,)
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            # Forget images removed from the disk by the user
+            if not os.path.exists(row[0]):
+                self._connection.execute("DELETE FROM images WHERE url = ?", (url,))
+                self._connection.execute(
+                    "DELETE FROM image_terms WHERE path = ?", (row[0],)
+                )
+                self._connection.commit()
+                return None
+
+            self._connection.execute(
+                "UPDATE images SET last_used = ? WHERE url = ?", (time.time(), url)
+            )
+            self._connection.commit()
+
+            return row[0]
+
+    def add(
+        self, url: str, path: str, content_hash: str, metadata: dict | None = None
+    ) -> None:
+        """Records image downloaded from url."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO images"
+                " (url, content_hash, path, size, last_used, metadata)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    content_hash,
+                    path,
+                    os.path.getsize(path),
+                    time.time(),
+                    json.dumps(metadata or {}),
+                ),
+            )
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO image_terms (term, path) VALUES (?, ?)",
+                [(term, path) for term in metadata_terms(metadata or {})],
+            )
+            self._connection.commit()
+
+    def touch(self, path: str) -> None:
+        """Marks image as recently used."""
+        with self._lock:
+            self._connection.execute(
+                "UPDATE images SET last_used = ? WHERE path = ?", (time.time(), path)
+            )
+            self._connection.commit()
+
+    def least_recently_used(self, exclude: set | None = None) -> str | None:
+        """Returns path of the least recently used image existing on disk."""
+        exclude = exclude or set()
+
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path FROM images GROUP BY path ORDER BY MAX(last_used)"
+            )
+            for (path,) in rows:
+                if path not in exclude and os.path.exists(path):
+                    return path
+
+        return None
+
+    def find_images(self, query: str) -> list[tuple[str, str, dict, int]]:
+        """Returns (url, path, metadata, matched words) of images, best match first."""
+        terms = sorted(metadata_terms({"query": query}))
+
+        with self._lock:
+            if terms:
+                rows = self._connection.execute(
+                    "SELECT images.url, images.path, images.metadata,"
+                    " COUNT(DISTINCT image_terms.term) AS matched"
+                    " FROM image_terms JOIN images ON images.path = image_terms.path"
+                    f" WHERE image_terms.term IN ({', '.join('?' * len(terms))})"
+                    " GROUP BY images.path ORDER BY matched DESC",
+                    terms,
+                ).fetchall()
+            else:
+                # Query without words matches every image
+                rows = self._connection.execute(
+                    "SELECT url, path, metadata, 0 FROM images GROUP BY path"
+                ).fetchall()
+
+        return [
+            (url, path, json.loads(metadata), matched)
+            for url, path, metadata, matched in rows
+            if os.path.exists(path)
+        ]
+
+    def get_search(self, key: str) -> dict | None:
+        """Returns cached search results with their ETag and fetch time."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT etag, fetched, results FROM searches WHERE key = ?", (key,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return {"etag": row[0], "fetched": row[1], "results": json.loads(row[2])}
+
+    def put_search(self, key: str, etag: str | None, results: list) -> None:
+        """Stores search results fetched just now."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO searches (key, etag, fetched, results)"
+                " VALUES (?, ?, ?, ?)",
+                (key, etag, time.time(), json.dumps(results)),
+            )
+            self._connection.commit()
+
+    def update_search_results(self, key: str, results: list) -> None:
+        """Replaces cached search results keeping their fetch time."""
+        with self._lock:
+            self._connection.execute(
+                "UPDATE searches SET results = ? WHERE key = ?",
+                (json.dumps(results), key),
+            )
+            self._connection.commit()
+
+    def get_state(self, key: str, default=None):
+        """Returns value stored in the state table."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM state WHERE key = ?", (key,)
+            ).fetchone()
+
+        return json.loads(row[0]) if row else default
+
+    def set_state(self, key: str, value) -> None:
+        """Stores JSON serializable value in the state table."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                (key, json.dumps(value)),
+            )
+            self._connection.commit()
+
+    def evict(self, max_bytes: int, max_files: int, keep: set | None = None) -> None:
+        """Removes least recently used images until cache fits the budget."""
+        # Applied wallpaper is never removed, a budget of 0 means no limit
+        keep = set(keep or ())
+        current = self.get_state("current_wallpaper")
+        if current:
+            keep.add(current)
+
+        with self._lock:
+            # Several URLs may share one file with the same content
+            rows = self._connection.execute(
+                "SELECT path, MAX(size) FROM images"
+                " GROUP BY path ORDER BY MAX(last_used)"
+            ).fetchall()
+
+            total_bytes = sum(size for _, size in rows)
+            total_files = len(rows)
+
+            for path, size in rows:
+                if (not max_bytes or total_bytes <= max_bytes) and (
+                    not max_files or total_files <= max_files
+                ):
+                    break
+                if path in keep:
+                    continue
+
+                if os.path.exists(path):
+                    os.remove(path)
+                self._connection.execute("DELETE FROM images WHERE path = ?", (path,))
+                self._connection.execute(
+                    "DELETE FROM image_terms WHERE path = ?", (path,)
+                )
+
+                total_bytes -= size
+                total_files -= 1
+
+            self._connection.commit()
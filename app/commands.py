@@ -0,0 +1,146 @@
+import shlex
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+# Commands containing these characters need a shell to run
+SHELL_CHARACTERS = set("|&;<>()$`*?~")
+
+
+@dataclass
+class CommandResult:
+    command: str
+    returncode: int | None  # None if command timed out
+    stderr: str
+    duration: float
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0
+
+
+def needs_shell(template: str) -> bool:
+    """Returns True if the command template uses shell syntax."""
+    return bool(SHELL_CHARACTERS & set(template))
+
+
+def expand_command(template: str, path: str) -> str | list[str]:
+    """Returns arguments, or a shell string if needed, with %PATH% safely inserted."""
+    if not needs_shell(template):
+        return [arg.replace("%PATH%", path) for arg in shlex.split(template)]
+
+    parts = template.split("%PATH%")
+    command = parts[0]
+    quote = _open_quote(parts[0])
+    for part in parts[1:]:
+        # Quote opened by the template is closed around the quoted path
+        command += f"{quote}{shlex.quote(path)}{quote}{part}"
+        quote = _open_quote(part, quote)
+
+    return command
+
+
+def _open_quote(text: str, quote: str = "") -> str:
+    """Returns the shell quote still open at the end of text."""
+    escaped = False
+    for char in text:
+        if escaped:
+            escaped = False
+        elif char == "\\" and quote != "'":
+            escaped = True
+        elif quote:
+            if char == quote:
+                quote = ""
+        elif char in "'\"":
+            quote = char
+
+    return quote
+
+
+def run_command(template: str, path: str, timeout: float) -> CommandResult:
+    """Runs command for the image file, killing it on timeout."""
+    command = template.replace("%PATH%", path)
+
+    start = time.perf_counter()
+    try:
+        args = expand_command(template, path)
+        process = subprocess.run(
+            args,
+            shell=isinstance(args, str),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+            timeout=timeout,
+        )
+        returncode, stderr = process.returncode, process.stderr
+    except subprocess.TimeoutExpired:
+        returncode, stderr = None, f"Timed out after {timeout} seconds"
+    except ValueError as ex:
+        # Template itself has unbalanced quotes
+        returncode, stderr = 2, f"Invalid command: {ex}"
+    except OSError as ex:
+        returncode, stderr = 127, str(ex)
+
+    return CommandResult(command, returncode, stderr, time.perf_counter() - start)
+
+
+def run_commands(
+    templates: list[str], path: str, timeout: float, parallel: bool = False
+) -> list[CommandResult]:
+    """Runs commands in order, or concurrently if parallel."""
+    if not parallel or len(templates) < 2:
+        return [run_command(template, path, timeout) for template in templates]
+
+    with ThreadPoolExecutor(max_workers=len(templates)) as executor:
+        return list(
+            executor.map(
+                lambda template: run_command(template, path, timeout), templates
+            )
+        )
+
+
+def apply_gsettings(templates: list[str], path: str) -> list[CommandResult] | None:
+    """Applies "gsettings set" commands through Gio, None if they must be run."""
+    changes = []
+    for template in templates:
+        try:
+            args = [] if needs_shell(template) else expand_command(template, path)
+        except ValueError:
+            return None
+        if len(args) != 5 or args[:2] != ["gsettings", "set"]:
+            return None
+        changes.append(args[2:])
+
+    try:
+        from gi.repository import Gio
+    except ImportError:
+        return None
+
+    source = Gio.SettingsSchemaSource.get_default()
+    settings = {}
+    for schema_id, key, _ in changes:
+        schema = source.lookup(schema_id, True) if source else None
+        if schema is None or not schema.has_key(key):
+            return None
+        if schema.get_key(key).get_value_type().dup_string() != "s":
+            return None
+        settings.setdefault(schema_id, Gio.Settings.new(schema_id))
+
+    start = time.perf_counter()
+
+    # Delay writes so every key of a schema is changed at once
+    for schema_settings in settings.values():
+        schema_settings.delay()
+    for schema_id, key, value in changes:
+        settings[schema_id].set_string(key, value)
+    for schema_settings in settings.values():
+        schema_settings.apply()
+    Gio.Settings.sync()
+
+    duration = time.perf_counter() - start
+    return [
+        CommandResult(template.replace("%PATH%", path), 0, "", duration)
+        for template in templates
+    ]
@@ -1,5 +1,7 @@
 import json
 import os
+import tempfile
+import threading
 
 APP_NAME = "wallpaper-ed"
 
@@ -12,6 +14,14 @@ class AppConfig:
             'gsettings set org.gnome.desktop.background picture-uri "file://%PATH%"',
             'gsettings set org.gnome.desktop.background picture-uri-dark "file://%PATH%"',
         ]
+        self.apply: dict = {
+            # Seconds before a wallpaper command is killed
+            "timeout": 10,
+            # Run wallpaper commands concurrently instead of in order
+            "parallel": False,
+            # Apply "gsettings set" commands in-process if PyGObject is importable
+            "native_gsettings": True,
+        }
         self.selected_api = "unsplash"
 
         self.apis: dict = {
@@ -23,19 +33,149 @@ class AppConfig:
                 "api_token": "",
                 "api_url": "https://wallhaven.cc/api/v1/search",
             },
+            # Folder indexed for changes at most every rescan_interval seconds
+            "local": {
+                "directory": "~/Pictures/Wallpapers",
+                "rescan_interval": 300,
+            },
         }
         self.download_directory: str = "~/.local/share/backgrounds"
-        self.image: dict = {"orientation": "landscape", "count": 1, "purity": "100"}
+        self.image: dict = {
+            "orientation": "landscape",
+            "count": 1,
+            "purity": "100",
+            # Largest image fetched, empty means the screen size
+            "max_resolution": "",
+            # JPEG quality of downscaled images
+            "quality": 85,
+            # Resize images after download, this loads PyQt6 also in headless runs
+            "downscale": False,
+            # Smaller images are rejected, empty disables the check
+            "min_resolution": "",
+            # Larger files are rejected, 0 disables the check
+            "max_bytes": 0,
+            # Allowed aspect difference from orientation ratios, 0 disables it
+            "aspect_tolerance": 0,
+        }
         self.orientation_ratios = {
             "landscape": "16x9,3x2,2x1,4x3,18x10,18x9,21x9",
             "squarish": "1x1",
             "portrait": "9x16,1x2,2x3,3x4,10x18,9x18,9x21",
         }
+        # HTTP timeouts and Retry-After cap in seconds, retries and download workers
+        self.network: dict = {
+            "connect_timeout": 5,
+            "read_timeout": 30,
+            "retries": 3,
+            "backoff_factor": 0.5,
+            "retry_after_max": 10,
+            "workers": 4,
+        }
+        # Downloaded images index and its budget, 0 means no limit,
+        # search results are reused for search_ttl seconds
+        self.cache: dict = {
+            "index": f"~/.local/share/{APP_NAME}/cache.sqlite3",
+            "max_bytes": 512 * 1024 * 1024,
+            "max_files": 200,
+            "search_ttl": 3600,
+        }
+        # Query used at login and whether its next image is downloaded ahead
+        self.autostart: dict = {"query": "", "stage": True}
+        # Daemon rotation interval in minutes and images downloaded ahead
+        self.rotation: dict = {"interval": 30, "ahead": 2}
+        # Share of API budget background downloads leave for interactive ones
+        self.rate_limit: dict = {"reserve": 0.2}
+        # Number of images downloaded ahead and buffer size that triggers refill
+        self.prefetch: dict = {"depth": 3, "low_watermark": 1}
+        # With selected_api "any", next provider starts if the previous one takes
+        # longer than this percentile of its latencies, or delay seconds if unknown
+        self.hedging: dict = {"percentile": 90, "delay": 1.0}
+        # Memory for decoded previews of browsed images and number of images
+        # remembered, older previews are decoded again from downloaded files
+        self.history: dict = {"preview_bytes": 64 * 1024 * 1024, "entries": 200}
+        # Downloaded image matching the query is used if providers cannot be
+        # reached, run out of budget or do not answer a search within deadline
+        self.offline: dict = {"fallback": True, "deadline": 10}
+
+        # Private attributes are not written to the config file
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._file_state = None
+
+    def options(self) -> dict:
+        """Returns options written to the config file."""
+        return {
+            name: value
+            for name, value in self.__dict__.items()
+            if not name.startswith("_")
+        }
+
+    def mark_dirty(self):
+        """Marks options as changed, flush_config writes them later."""
+        self._dirty = True
+
+    def flush_config(self) -> bool:
+        """Writes options if they were marked dirty. Returns True if written."""
+        if not self._dirty:
+            return False
+
+        self.write_config()
+        return True
 
     def write_config(self):
-        with open(self.config_filename, "w") as config_file:
-            json.dump(self.__dict__, config_file)
+        """Writes options atomically, the file is never seen half written."""
+        directory = os.path.dirname(self.config_filename)
+        os.makedirs(directory, exist_ok=True)
+
+        with self._lock:
+            self._dirty = False
+            file_descriptor, temp_filename = tempfile.mkstemp(
+                dir=directory, prefix=".config-", suffix=".json"
+            )
+            try:
+                with os.fdopen(file_descriptor, "w") as config_file:
+                    json.dump(self.options(), config_file)
+                    config_file.flush()
+                    os.fsync(config_file.fileno())
+                os.replace(temp_filename, self.config_filename)
+            except BaseException:
+                os.remove(temp_filename)
+                raise
+
+            self._file_state = self._stat_config()
 
     def load_config(self):
-        with open(self.config_filename, "r") as config_file:
-            self.__dict__ = json.load(config_file)
+        with self._lock:
+            file_state = self._stat_config()
+            default_apis = self.apis
+            with open(self.config_filename, "r") as config_file:
+                # Keep defaults for options missing in older config files
+                self.__dict__.update(json.load(config_file))
+            for api_name, api_config in default_apis.items():
+                self.apis.setdefault(api_name, api_config)
+
+            self._file_state = file_state
+
+    def reload_if_changed(self) -> bool:
+        """Loads config file again if another process changed it. Returns True if so."""
+        # Options waiting for flush_config are kept
+        file_state = self._stat_config()
+        if self._dirty or file_state is None or file_state == self._file_state:
+            return False
+
+        # File may be caught in the middle of a non-atomic save by an editor
+        try:
+            self.load_config()
+        except ValueError:
+            return False
+
+        return True
+
+    def _stat_config(self) -> tuple | None:
+        """Returns inode, modification time and size of the config file."""
+        try:
+            stat = os.stat(self.config_filename)
+        except OSError:
+            return None
+
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
@@ -1,63 +1,497 @@
-import requests
-from http.client import responses
+from __future__ import annotations
+
 from config import AppConfig
-import random
-import string
+import imageinfo
+import providers
 import os
+import json
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import TYPE_CHECKING
+
+# HTTP client, image index and command runner are loaded on first use
+if TYPE_CHECKING:
+    import requests
+    from cache import ImageCache
+    from localindex import LocalImageIndex
 
 
+# Default program data, options are loaded from the config file by init()
 program_data = AppConfig()
-available_apis = program_data.apis.keys()
 
+# API name searching all configured providers at once
+ANY_API = "any"
+
+# Bytes read at most to find image dimensions in its header
+PROBE_LIMIT = 256 * 1024
+
+# Search results tried when images are rejected by their headers
+MAX_CANDIDATES = 5
+
+# Seconds after which abandoned partial downloads are removed
+PARTIAL_DOWNLOAD_MAX_AGE = 24 * 60 * 60
+
+# Number of latest request latencies kept per API
+LATENCY_SAMPLES = 50
+
+
+class RateLimitError(Exception):
+    """Raised when API request budget does not allow another request."""
+
+
+# Prefetch buffers keyed by (api, query, orientation, purity)
+_prefetch_lock = threading.Lock()
+_prefetched_results: dict[tuple, deque] = {}
+_prefetched_images: dict[tuple, deque] = {}
+_prefetch_threads: dict[tuple, threading.Thread] = {}
+
+# Screen resolution reported by the GUI, used when no maximum is configured,
+# headless runs read the last one from the cache state
+screen_resolution: tuple[int, int] | None = None
+
+# Downloaded images index, opened on first use
+_cache = None
+_cache_lock = threading.Lock()
+
+# Local folder image index, opened on first use
+_local_index = None
+_local_index_lock = threading.Lock()
+
+# Rate limit budget updates, background requests are marked per thread
+_rate_limit_lock = threading.Lock()
+_request_context = threading.local()
+
+# Locks of URLs being downloaded with number of threads using them
+_download_locks: dict[str, tuple[threading.Lock, int]] = {}
+_download_locks_lock = threading.Lock()
+
+# Shared HTTP session, created on first request
+_session = None
+_session_lock = threading.Lock()
+
+
+def init(config: AppConfig | None = None) -> AppConfig:
+    """Sets up program data from config, the default one if not given. Returns it."""
+    global program_data
+
+    if config is not None:
+        program_data = config
+
+    # Check if config file exists and create one if not
+    if not os.path.exists(program_data.config_filename) or os.path.isdir(
+        program_data.config_filename
+    ):
+        program_data.write_config()
+    else:
+        program_data.load_config()
+
+    return program_data
+
+
+def get_session() -> requests.Session:
+    """Returns shared HTTP session with connection pooling and retries."""
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.util.retry import Retry
+
+            retry_after_max = program_data.network.get("retry_after_max", 10)
+
+            class CappedRetry(Retry):
+                # 429 is returned to api_get, so every response counts in the budget
+                RETRY_AFTER_STATUS_CODES = frozenset({503})
+
+                # Long Retry-After would block the worker beyond any timeout
+                def get_retry_after(self, response):
+                    retry_after = super().get_retry_after(response)
+                    if retry_after is None:
+                        return None
+                    return min(retry_after, retry_after_max)
+
+            # Retry server errors honouring a capped Retry-After header
+            retry = CappedRetry(
+                total=program_data.network.get("retries", 3),
+                backoff_factor=program_data.network.get("backoff_factor", 0.5),
+                status_forcelist=(500, 502, 503, 504),
+                allowed_methods=("GET",),
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            # Keep-alive connections are pooled per host
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=retry)
+
+            _session = requests.Session()
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+
+    return _session
+
+
+def http_get(url: str, **kwargs) -> requests.Response:
+    """Sends GET request through shared session using configured timeouts."""
+    kwargs.setdefault(
+        "timeout",
+        (
+            program_data.network.get("connect_timeout", 5),
+            program_data.network.get("read_timeout", 30),
+        ),
+    )
+    return get_session().get(url, **kwargs)
+
+
+@contextmanager
+def background_requests():
+    """Marks API requests made in the block as background ones."""
+    previous = getattr(_request_context, "background", False)
+    _request_context.background = True
+    try:
+        yield
+    finally:
+        _request_context.background = previous
+
+
+def in_request_context(function):
+    """Returns function running in pool threads with the caller's request context."""
+    background = getattr(_request_context, "background", False)
+
+    def run(*args, **kwargs):
+        previous = getattr(_request_context, "background", False)
+        _request_context.background = background
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _request_context.background = previous
+
+    return run
+
+
+def get_provider(api_name: str) -> providers.Provider:
+    """Returns search provider of the API configured from program_data."""
+    provider_class = providers.PROVIDERS.get(api_name)
+    if provider_class is None:
+        raise ValueError(f"Unsupported API selected: {api_name}")
+
+    return provider_class(api_name, program_data)
+
+
+def configured_providers() -> list[providers.RemoteProvider]:
+    """Returns remote providers usable with the current config, fastest first."""
+    configured = []
+    for api_name in program_data.apis:
+        try:
+            provider = get_provider(api_name)
+        except ValueError:
+            continue
+        if isinstance(provider, providers.RemoteProvider) and provider.is_configured():
+            configured.append(provider)
+
+    # Providers without latency samples yet are tried first
+    return sorted(
+        configured, key=lambda provider: latency_percentile(provider.name, 50) or 0
+    )
+
+
+def get_rate_limit(api_name: str) -> dict:
+    """Returns remaining request budget of the API tracked across runs."""
+    provider_class = providers.PROVIDERS.get(api_name, providers.Provider)
+    limit, _ = provider_class.rate_limit
+    budget = get_cache().get_state(f"rate_limit:{api_name}") or {
+        "limit": limit,
+        "remaining": limit,
+        "reset_at": None,
+        "latency": None,
+    }
+    budget.setdefault("latencies", [])
+
+    # Budget is renewed when its window is over
+    if budget["reset_at"] is not None and time.time() >= budget["reset_at"]:
+        budget.update(remaining=budget["limit"], reset_at=None)
+
+    return budget
+
+
+def check_rate_limit(api_name: str) -> None:
+    """Raises RateLimitError if the API budget does not allow another request."""
+    budget = get_rate_limit(api_name)
+    if not budget["limit"]:
+        return
+
+    # Background requests leave part of the budget for interactive ones
+    reserve = 0
+    if getattr(_request_context, "background", False):
+        reserve = budget["limit"] * program_data.rate_limit.get("reserve", 0.2)
+
+    if budget["remaining"] <= reserve:
+        resets_in = max(0, round((budget["reset_at"] or time.time()) - time.time()))
+        raise RateLimitError(
+            f"{api_name} request budget is used up, it resets in {resets_in} s"
+        )
+
+
+def record_rate_limit(
+    api_name: str, response: requests.Response, latency: float
+) -> None:
+    """Updates API budget and latency statistics from the response."""
+    _, window = providers.PROVIDERS.get(api_name, providers.Provider).rate_limit
+
+    with _rate_limit_lock:
+        budget = get_rate_limit(api_name)
+        now = time.time()
+
+        if budget["reset_at"] is None:
+            budget["reset_at"] = now + window
+
+        # Unsplash reports its budget, others are counted locally
+        headers = response.headers
+        if "X-Ratelimit-Limit" in headers:
+            budget["limit"] = int(headers["X-Ratelimit-Limit"])
+        if "X-Ratelimit-Remaining" in headers:
+            budget["remaining"] = int(headers["X-Ratelimit-Remaining"])
+        else:
+            budget["remaining"] = max(0, budget["remaining"] - 1)
+
+        if response.status_code == 429:
+            budget["remaining"] = 0
+            retry_after = headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                budget["reset_at"] = now + int(retry_after)
+
+        if budget["latency"] is None:
+            budget["latency"] = latency
+        else:
+            budget["latency"] = 0.8 * budget["latency"] + 0.2 * latency
+        budget["latencies"] = (budget["latencies"] + [latency])[-LATENCY_SAMPLES:]
+
+        get_cache().set_state(f"rate_limit:{api_name}", budget)
+
+
+def latency_percentile(api_name: str, percentile: float) -> float | None:
+    """Returns latency percentile of the latest API requests, None if unknown."""
+    latencies = sorted(get_rate_limit(api_name)["latencies"])
+    if not latencies:
+        return None
+
+    index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+    return latencies[index]
+
+
+def api_get(api_name: str, url: str, **kwargs) -> requests.Response:
+    """Sends API request if its budget allows, tracking the budget and latency."""
+    check_rate_limit(api_name)
+
+    start = time.perf_counter()
+    response = http_get(url, **kwargs)
+    record_rate_limit(api_name, response, time.perf_counter() - start)
 
-# Check if config file exists and create one if not
-if not os.path.exists(program_data.config_filename) or os.path.isdir(
-    program_data.config_filename
-):
-    program_data.write_config()
-else:
-    program_data.load_config()
+    if response.status_code == 429:
+        raise RateLimitError(f"{api_name} rate limit reached, try again later")
 
-# Initializing Unsplash API token and URL
+    return response
 
 
-def seed(length=6):
-    characters = string.ascii_letters + string.digits
-    return "".join(random.choices(characters, k=length))
+def get_cache() -> ImageCache:
+    """Returns downloaded images index."""
+    global _cache
 
+    with _cache_lock:
+        if _cache is None:
+            from cache import ImageCache
 
-def set_wallpaper(filepath: str) -> None:
-    """Sets new desktop wallpaper."""
+            _cache = ImageCache(program_data.cache["index"])
 
-    # Executes command to set wallpaper replacing %PATH% with actual downloaded file path
-    for command in program_data.execute:
-        command = command.replace("%PATH%", filepath)
-        os.system(command=command)
+    return _cache
 
 
-def save_image(content: bytes, filename: str = "wallpaper.jpg") -> None:
-    """Saves image locally. Returns downloaded file location"""
+def get_local_index() -> LocalImageIndex:
+    """Returns index of images in the local folder."""
+    global _local_index
+
+    with _local_index_lock:
+        if _local_index is None:
+            from localindex import LocalImageIndex
+
+            _local_index = LocalImageIndex(get_cache())
+
+    return _local_index
+
+
+def evict_cache(keep: set | None = None) -> None:
+    """Keeps download directory under the configured budget."""
+    keep = set(keep or ())
+
+    # Images waiting in prefetch buffers are about to be shown
+    with _prefetch_lock:
+        for images in _prefetched_images.values():
+            keep.update(path for _, path in images)
+
+    # Images staged for the next login and queued for rotation
+    cache = get_cache()
+    staged = cache.get_state("staged_wallpaper")
+    if staged:
+        keep.add(staged["path"])
+    keep.update(cache.get_state("rotation_queue", []))
+
+    cache.evict(
+        max_bytes=program_data.cache.get("max_bytes", 0),
+        max_files=program_data.cache.get("max_files", 0),
+        keep=keep,
+    )
+
+    # Remove partial downloads nobody resumed
+    with os.scandir(get_download_directory()) as entries:
+        for entry in entries:
+            if not entry.name.endswith((".part", ".part.json")):
+                continue
+            if time.time() - entry.stat().st_mtime > PARTIAL_DOWNLOAD_MAX_AGE:
+                os.remove(entry.path)
+
+
+def set_wallpaper(filepath: str) -> float:
+    """Sets new desktop wallpaper. Returns time spent applying it in seconds."""
+
+    # Protect applied wallpaper from cache eviction
+    get_cache().set_state("current_wallpaper", filepath)
+    get_cache().touch(filepath)
+
+    import commands
+
+    start = time.perf_counter()
+
+    # Set gsettings keys in-process when possible, otherwise run the commands
+    results = None
+    if program_data.apply.get("native_gsettings", True):
+        results = commands.apply_gsettings(program_data.execute, filepath)
+    if results is None:
+        results = commands.run_commands(
+            program_data.execute,
+            filepath,
+            timeout=program_data.apply.get("timeout", 10),
+            parallel=program_data.apply.get("parallel", False),
+        )
+
+    elapsed = time.perf_counter() - start
+
+    failed = [result for result in results if not result.ok]
+    if failed:
+        raise RuntimeError(
+            "\n".join(
+                f"'{result.command}' failed ({result.returncode}): {result.stderr.strip()}"
+                for result in failed
+            )
+        )
+
+    return elapsed
+
+
+def get_download_directory() -> str:
+    """Returns download directory path, creating it if not exists."""
 
     dir_ = os.path.expanduser(program_data.download_directory)
     # Set up download directory if not exists
     if not os.path.exists(dir_):
         os.mkdir(dir_)
 
-    # Writing data to the image
-    filepath = os.path.join(dir_, filename)
-    with open(filepath, "wb") as write_image:
-        write_image.write(content)
+    return dir_
 
-    return filepath
 
+def set_screen_resolution(width: int, height: int) -> None:
+    """Sets physical screen resolution, remembered for headless runs."""
+    global screen_resolution
+
+    screen_resolution = (width, height)
+    cache = get_cache()
+    if cache.get_state("screen_resolution") != [width, height]:
+        cache.set_state("screen_resolution", [width, height])
+
+
+def target_resolution() -> tuple[int, int] | None:
+    """Returns (width, height) images are fetched at, None if not limited."""
+    max_resolution = program_data.image.get("max_resolution")
+    if max_resolution:
+        width, height = (int(side) for side in max_resolution.lower().split("x"))
+    else:
+        # Headless runs use the screen size last seen by the GUI
+        resolution = screen_resolution or get_cache().get_state("screen_resolution")
+        if not resolution:
+            return None
+        width, height = resolution
+
+    # Match target shape with the selected orientation
+    orientation = program_data.image.get("orientation")
+    if (orientation == "portrait" and width > height) or (
+        orientation == "landscape" and width < height
+    ):
+        width, height = height, width
+
+    return width, height
+
+
+def downscale_image(filepath: str) -> None:
+    """Downscales image to cover target resolution and recompresses it as JPEG."""
+    resolution = target_resolution()
+    if not resolution:
+        return
+
+    # Qt is only needed when local downscaling is enabled
+    from PyQt6.QtCore import Qt
+    from PyQt6.QtGui import QImage
+
+    image = QImage(filepath)
+    width, height = resolution
+    if image.isNull() or image.width() <= width or image.height() <= height:
+        return
 
-def get_image_url(query: str) -> str:
-    """Fetches URL of the image from the selected API."""
-    api_name = program_data.selected_api
-    api_config = program_data.apis.get(api_name)
+    image = image.scaled(
+        width,
+        height,
+        Qt.AspectRatioMode.KeepAspectRatioByExpanding,
+        Qt.TransformationMode.SmoothTransformation,
+    )
+    image.save(filepath, "JPG", program_data.image.get("quality", 85))
 
-    if not api_config:
-        raise ValueError(f"No API config found for '{api_name}'")
+    with open(filepath, "rb") as image_file:
+        os.fsync(image_file.fileno())
+
+
+def prefetch_key(query: str) -> tuple:
+    """Returns prefetch buffer key for the query and current settings."""
+    return (
+        program_data.selected_api,
+        query,
+        program_data.image.get("orientation"),
+        program_data.image.get("purity"),
+    )
+
+
+def search_key(query: str, page: int = 1, api_name: str | None = None) -> str:
+    """Returns search cache key for the normalized query and current settings."""
+    return json.dumps(
+        [
+            api_name or program_data.selected_api,
+            " ".join(query.lower().split()),
+            program_data.image.get("orientation"),
+            program_data.image.get("purity"),
+            # Result URLs are sized for the screen they were searched on
+            target_resolution(),
+            page,
+        ]
+    )
+
+
+def search_images(
+    query: str, count: int = 1, etag: str | None = None, api_name: str | None = None
+) -> tuple[list[dict] | None, str | None]:
+    """Fetches result page from the API. Returns results and the response ETag."""
+    headers = {"If-None-Match": etag} if etag else {}
+    api_name = api_name or program_data.selected_api
+    provider = get_provider(api_name)
 
     orientation = program_data.image.get("orientation")
     purity = program_data.image.get("purity")
@@ -65,60 +499,729 @@ def get_image_url(query: str) -> str:
     if not orientation or not purity:
         raise ValueError("Missing orientation or purity in program_data.image")
 
-    if api_name == "wallhaven":
-        ratio = program_data.orientation_ratios.get(orientation)
-        if not ratio:
-            raise ValueError(f"No ratio found for orientation '{orientation}'")
+    resolution = target_resolution()
+    response = api_get(
+        api_name, provider.search_url(query, count, resolution), headers=headers
+    )
+
+    if response.status_code == 304:
+        return None, etag
+    if response.status_code != 200:
+        import requests
+        from http.client import responses
 
-        url = (
-            f"{api_config['api_url']}?apikey={api_config['api_token']}"
-            f"&ratios={ratio}&q={query}&purity={purity}&seed={seed()}"
+        raise requests.HTTPError(
+            f"{response.status_code} - {responses.get(response.status_code, 'Unknown error')}",
+            response=response,
         )
 
-        response = requests.get(url)
+    results = provider.parse_results(response.json(), resolution)
+    return results, response.headers.get("ETag")
+
 
-        if response.status_code != 200:
-            raise requests.HTTPError(
-                f"{response.status_code} - {responses.get(response.status_code, 'Unknown error')}"
+def search_any_provider(query: str, count: int = 1) -> list[dict]:
+    """Returns first non-empty results of configured providers, hedging slow ones."""
+    pending_providers = configured_providers()
+    if not pending_providers:
+        raise ValueError("No API is configured")
+
+    percentile = program_data.hedging.get("percentile", 90)
+    default_delay = program_data.hedging.get("delay", 1.0)
+
+    search = in_request_context(cached_search_images)
+
+    executor = ThreadPoolExecutor(max_workers=len(pending_providers))
+    running = set()
+    errors = []
+    hedge_delay = None
+
+    try:
+        while pending_providers or running:
+            if pending_providers:
+                provider = pending_providers.pop(0)
+                running.add(executor.submit(search, query, count, provider.name))
+                # Next provider starts if this one is slower than usual
+                hedge_delay = (
+                    latency_percentile(provider.name, percentile) or default_delay
+                )
+
+            done, running = wait(
+                running,
+                timeout=hedge_delay if pending_providers else None,
+                return_when=FIRST_COMPLETED,
             )
+            for future in done:
+                try:
+                    results = future.result()
+                except Exception as ex:
+                    errors.append(ex)
+                    continue
+                if results:
+                    return results
+    finally:
+        # Slower providers still fill the search cache for the next calls
+        executor.shutdown(wait=False, cancel_futures=True)
 
-        data = response.json().get("data", [])
-        if not data:
-            raise ValueError("No image data returned from Wallhaven")
+    raise errors[0] if errors else ValueError("No images found for the query")
 
-        return random.choice(data)["path"]
 
-    elif api_name == "unsplash":
-        url = (
-            f"{api_config['api_url']}?client_id={api_config['api_token']}"
-            f"&orientation={orientation}&query={query}"
+def get_search_result(query: str, count: int = 1) -> dict:
+    """Returns next search result for the query, count results are fetched at once."""
+    key = prefetch_key(query)
+
+    # Serve result left over from the previous result page
+    with _prefetch_lock:
+        results = _prefetched_results.get(key)
+        if results:
+            return results.popleft()
+
+    if program_data.selected_api == ANY_API:
+        results = search_any_provider(query, count=count)
+    else:
+        results = cached_search_images(query, count=count)
+
+    # Random generator is seeded on first use, not at import
+    import random
+
+    random.shuffle(results)
+    with _prefetch_lock:
+        _prefetched_results[key] = deque(results[1:])
+
+    return results[0]
+
+
+def cached_search_images(
+    query: str, count: int = 1, api_name: str | None = None
+) -> list[dict]:
+    """Returns search results for the query, served from search cache if possible."""
+    api_name = api_name or program_data.selected_api
+    provider = get_provider(api_name)
+    if isinstance(provider, providers.LocalProvider):
+        return search_local_images(provider, query, count=count)
+
+    cache = get_cache()
+    key = search_key(query, api_name=api_name)
+    entry = cache.get_search(key)
+
+    fresh = (
+        entry is not None
+        and entry["results"]
+        and time.time() - entry["fetched"] < program_data.cache.get("search_ttl", 3600)
+    )
+
+    if fresh:
+        results = entry["results"]
+    else:
+        # Fetch whole batch of random photos to serve the next calls from cache
+        etag = entry["etag"] if entry and entry["results"] else None
+        results, etag = search_images(
+            query,
+            count=provider.max_count if provider.consumable else count,
+            etag=etag,
+            api_name=api_name,
         )
+        if results is None:
+            results = entry["results"]
+        if not results:
+            raise ValueError("No images found for the query")
 
-        response = requests.get(url)
+    # Results cached before providers were introduced do not name their API
+    results = [dict(result, api=result.get("api", api_name)) for result in results]
 
-        if response.status_code != 200:
-            raise requests.HTTPError(
-                f"{response.status_code} - {responses.get(response.status_code, 'Unknown error')}"
+    if provider.consumable:
+        results, remaining = results[:count], results[count:]
+    else:
+        remaining = results
+
+    # Consumed random photos are dropped, other pages are kept for the next runs
+    if fresh:
+        if provider.consumable:
+            cache.update_search_results(key, remaining)
+    else:
+        cache.put_search(key, etag, remaining)
+
+    return list(results)
+
+
+def search_local_images(
+    provider: providers.LocalProvider, query: str, count: int = 1
+) -> list[dict]:
+    """Returns random images of the selected orientation from the local folder."""
+    if not provider.is_configured():
+        raise ValueError(f"Local folder '{provider.directory}' does not exist")
+
+    index = get_local_index()
+    cache = get_cache()
+    updated = cache.get_state("local_index_updated") or {}
+    rescan_interval = provider.api_config.get("rescan_interval", 300)
+
+    # Index is updated at most every rescan_interval or for another folder
+    if (
+        updated.get("directory") != provider.directory
+        or time.time() - updated["at"] >= rescan_interval
+    ):
+        index.update(provider.directory)
+        cache.set_state(
+            "local_index_updated", {"directory": provider.directory, "at": time.time()}
+        )
+
+    orientation = program_data.image.get("orientation")
+    images = index.random_images(
+        orientation, count=count, query=query, root=provider.directory
+    )
+
+    # Files removed or replaced since the last update are checked again
+    current = []
+    for image in images:
+        try:
+            stat = os.stat(image["path"])
+        except OSError:
+            index.remove(image["path"])
+            continue
+
+        if (stat.st_size, stat.st_mtime_ns) != (image["size"], image["mtime"]):
+            image = index.refresh(image["path"])
+            if image is None or image["orientation"] != orientation:
+                continue
+
+        current.append(image)
+
+    if not current:
+        raise ValueError("No images found for the query")
+
+    return provider.parse_results(current, target_resolution())
+
+
+def get_image(query: str, progress=None, thumbnail=None) -> tuple[str, str]:
+    """Returns URL and local path of the next image, prefetched one if possible."""
+    key = prefetch_key(query)
+
+    with _prefetch_lock:
+        images = _prefetched_images.get(key)
+        image = images.popleft() if images else None
+
+    if image is None:
+        image = download_next_image(query, progress=progress, thumbnail=thumbnail)
+
+    _refill_prefetch_buffer(key, query)
+
+    return image
+
+
+def download_next_image(
+    query: str, progress=None, thumbnail=None
+) -> tuple[str, str]:
+    """Downloads next suitable image for the query. Returns URL and local path."""
+    # Background downloads fill buffers ahead, never with already seen images
+    fallback = program_data.offline.get("fallback", True) and not getattr(
+        _request_context, "background", False
+    )
+
+    try:
+        for attempt in range(MAX_CANDIDATES):
+            if fallback:
+                result = _get_search_result_within_deadline(query)
+            else:
+                result = get_search_result(query)
+            url = result["url"]
+
+            # Thumbnail is optional, a failed one must not fail the image
+            if thumbnail and result.get("thumbnail"):
+                import requests
+
+                try:
+                    thumbnail_data = get_image_as_bytes(result["thumbnail"])
+                except requests.RequestException:
+                    thumbnail_data = None
+                if thumbnail_data:
+                    thumbnail(url, thumbnail_data)
+
+            # Results rejected by their headers are skipped, up to MAX_CANDIDATES
+            try:
+                return url, download_image(
+                    url, progress=progress, metadata=result_metadata(result, query)
+                )
+            except UnsuitableImageError:
+                if attempt == MAX_CANDIDATES - 1:
+                    raise
+    except Exception as ex:
+        if not fallback or not is_offline_error(ex):
+            raise
+
+        # Providers cannot serve the request, use the best downloaded image
+        try:
+            return cached_image_for_query(query)
+        except ValueError:
+            raise ex
+
+
+def _get_search_result_within_deadline(query: str) -> dict:
+    """Returns next search result, raises TimeoutError after offline.deadline."""
+    deadline = program_data.offline.get("deadline", 0)
+    if not deadline:
+        return get_search_result(query)
+
+    # Late search still fills the search cache for the next calls
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        return executor.submit(get_search_result, query).result(timeout=deadline)
+    except FutureTimeoutError:
+        raise TimeoutError(f"Search took longer than {deadline} seconds")
+    finally:
+        executor.shutdown(wait=False)
+
+
+def is_offline_error(error: Exception) -> bool:
+    """Returns True if error means providers cannot serve requests right now."""
+    import requests
+
+    # Server errors mean the provider is down, client errors need fixing
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and error.response.status_code >= 500
+
+    return isinstance(
+        error,
+        (
+            RateLimitError,
+            TimeoutError,
+            ConnectionError,
+            requests.ConnectionError,
+            requests.Timeout,
+        ),
+    )
+
+
+def result_metadata(result: dict, query: str) -> dict:
+    """Returns metadata kept with the image downloaded for the search result."""
+    return {
+        "api": result.get("api", program_data.selected_api),
+        "query": query,
+        "tags": result.get("tags", []),
+        "colors": result.get("colors", []),
+        "resolution": result.get("resolution"),
+    }
+
+
+def cached_image_for_query(query: str) -> tuple[str, str]:
+    """Returns URL and path of the downloaded image best matching the query."""
+    import random
+    from localindex import image_orientation
+
+    cache = get_cache()
+    current = cache.get_state("current_wallpaper")
+    orientation = program_data.image.get("orientation")
+
+    # Applied wallpaper and other orientations only if nothing else is left
+    def preferred(image: tuple) -> bool:
+        _, path, metadata, _ = image
+        resolution = metadata.get("resolution")
+        if path == current:
+            return False
+        if not resolution:
+            return True
+
+        width, height = (int(side) for side in resolution.lower().split("x"))
+        return image_orientation(width, height) == orientation
+
+    images = cache.find_images(query)
+    candidates = [image for image in images if preferred(image)] or images
+    if not candidates:
+        raise ValueError("No downloaded image matches the query")
+
+    best = [image for image in candidates if image[3] == candidates[0][3]]
+    url, path, _, _ = random.choice(best)
+    cache.touch(path)
+
+    return url, path
+
+
+def set_new_wallpaper(query: str) -> str:
+    """Sets staged or next image for the query as wallpaper. Returns file location."""
+    filepath = pop_staged_wallpaper(query)
+
+    if filepath is None:
+        _, filepath = download_next_image(query)
+
+    set_wallpaper(filepath=filepath)
+
+    return filepath
+
+
+def stage_next_wallpaper(query: str) -> str:
+    """Downloads image applied at the next login. Returns file location."""
+    _, filepath = download_next_image(query)
+    get_cache().set_state(
+        "staged_wallpaper",
+        {"path": filepath, "query": query, "api": program_data.selected_api},
+    )
+
+    return filepath
+
+
+def pop_staged_wallpaper(query: str) -> str | None:
+    """Returns staged image for the query and current API and clears the stage."""
+    cache = get_cache()
+    staged = cache.get_state("staged_wallpaper")
+
+    if not staged or staged["query"] != query:
+        return None
+    if staged["api"] != program_data.selected_api:
+        return None
+
+    cache.set_state("staged_wallpaper", None)
+
+    return staged["path"] if os.path.exists(staged["path"]) else None
+
+
+def has_staged_wallpaper(query: str) -> bool:
+    """Returns True if an image is staged for the query and current API."""
+    staged = get_cache().get_state("staged_wallpaper")
+    return bool(
+        staged
+        and staged["query"] == query
+        and staged["api"] == program_data.selected_api
+        and os.path.exists(staged["path"])
+    )
+
+
+def fetch_images(query: str, count: int | None = None) -> list[str]:
+    """Downloads count images for the query concurrently. Returns file locations."""
+    count = count or program_data.image.get("count", 1)
+
+    # Collect unique results, limiting searches for queries with few results
+    results = []
+    urls = set()
+    for _ in range(count * 2):
+        if len(results) >= count:
+            break
+
+        result = get_search_result(query, count=count - len(results))
+        if result["url"] not in urls:
+            urls.add(result["url"])
+            results.append(result)
+
+    @in_request_context
+    def download(result: dict) -> str:
+        try:
+            return download_image(
+                result["url"], metadata=result_metadata(result, query)
             )
+        except UnsuitableImageError:
+            return download_next_image(query)[1]
 
-        data = response.json()
-        return data.get("urls", {}).get("full")
+    workers = min(len(results), program_data.network.get("workers", 4))
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        return list(executor.map(download, results))
 
-    else:
-        raise ValueError(f"Unsupported API selected: {api_name}")
 
+def _refill_prefetch_buffer(key: tuple, query: str) -> None:
+    """Starts background download of next images when the buffer runs low."""
+    with _prefetch_lock:
+        # Only the latest query keeps downloaded images queued
+        for other_key in list(_prefetched_images):
+            if other_key != key:
+                del _prefetched_images[other_key]
 
-def get_image_as_bytes(url: str) -> bytes | None:
-    """Parse image from url and returns image data as bytes."""
+        images = _prefetched_images.setdefault(key, deque())
+        thread = _prefetch_threads.get(key)
 
-    # Parse image url
-    response = requests.get(url=url)
+        if len(images) > program_data.prefetch.get("low_watermark", 1):
+            return
+        if thread is not None and thread.is_alive():
+            return
 
-    # Return content as bytes
+        thread = threading.Thread(
+            target=_prefetch_images, args=(key, query), daemon=True
+        )
+        _prefetch_threads[key] = thread
+
+    thread.start()
+
+
+def _prefetch_images(key: tuple, query: str) -> None:
+    """Downloads images ahead until the buffer reaches configured depth."""
+    with background_requests():
+        _prefetch_images_until_full(key, query)
+
+    with _prefetch_lock:
+        if _prefetch_threads.get(key) is threading.current_thread():
+            del _prefetch_threads[key]
+
+
+def _prefetch_images_until_full(key: tuple, query: str) -> None:
+    depth = program_data.prefetch.get("depth", 3)
+
+    while True:
+        with _prefetch_lock:
+            images = _prefetched_images.get(key)
+            if images is None or len(images) >= depth:
+                break
+
+        # Stop if settings were changed in the meantime
+        if prefetch_key(query) != key:
+            break
+
+        # Stop on any failure, including when API budget runs low
+        try:
+            image = download_next_image(query)
+        except Exception:
+            break
+
+        with _prefetch_lock:
+            images = _prefetched_images.get(key)
+            if images is None:
+                break
+            images.append(image)
+
+
+def _check_image_response(response: requests.Response) -> None:
+    """Raises HTTPError if image request was not successful."""
     if response.status_code != 200:
+        import requests
+        from http.client import responses
+
         error_msg = f"{response.status_code} - {responses[response.status_code]}"
         if response.status_code == 401:
             error_msg += f"\nUnsplash API Access Token is invalid or not specified.\n"
-        raise requests.HTTPError(error_msg)
+        raise requests.HTTPError(error_msg, response=response)
+
+
+def get_image_as_bytes(url: str) -> bytes | None:
+    """Parse image from url and returns image data as bytes."""
+
+    # Parse image url
+    response = http_get(url)
+
+    # Return content as bytes
+    _check_image_response(response)
 
     return response.content
+
+
+class IncompleteDownloadError(ConnectionError):
+    """Raised when download ended before all image bytes were received."""
+
+
+class UnsuitableImageError(ValueError):
+    """Raised when image headers show it does not meet configured limits."""
+
+
+def check_image_suitable(
+    size: int, probed: tuple[str, int, int] | None = None
+) -> None:
+    """Raises UnsuitableImageError if image size or probed header break limits."""
+    max_bytes = program_data.image.get("max_bytes", 0)
+    if max_bytes and size > max_bytes:
+        raise UnsuitableImageError(f"Image has {size} bytes, limit is {max_bytes}")
+
+    if probed is None:
+        return
+    _, width, height = probed
+
+    min_resolution = program_data.image.get("min_resolution")
+    if min_resolution:
+        min_width, min_height = (
+            int(side) for side in min_resolution.lower().split("x")
+        )
+        if width < min_width or height < min_height:
+            raise UnsuitableImageError(
+                f"Image is {width}x{height}, minimum is {min_resolution}"
+            )
+
+    tolerance = program_data.image.get("aspect_tolerance", 0)
+    orientation = program_data.image.get("orientation")
+    ratios = program_data.orientation_ratios.get(orientation)
+    if tolerance and ratios:
+        aspect = width / height
+        for ratio in ratios.split(","):
+            ratio_width, ratio_height = (int(side) for side in ratio.split("x"))
+            if abs(aspect / (ratio_width / ratio_height) - 1) <= tolerance:
+                return
+        raise UnsuitableImageError(
+            f"Image is {width}x{height}, aspect does not match '{orientation}'"
+        )
+
+
+@contextmanager
+def _url_lock(url: str):
+    """Serializes downloads of the same URL across threads."""
+    with _download_locks_lock:
+        lock, users = _download_locks.get(url, (threading.Lock(), 0))
+        _download_locks[url] = (lock, users + 1)
+
+    try:
+        with lock:
+            yield
+    finally:
+        with _download_locks_lock:
+            lock, users = _download_locks[url]
+            if users == 1:
+                del _download_locks[url]
+            else:
+                _download_locks[url] = (lock, users - 1)
+
+
+def download_image(
+    url: str,
+    progress=None,
+    chunk_size: int = 65536,
+    metadata: dict | None = None,
+) -> str:
+    """Streams image from url to the download directory. Returns file location."""
+    # Images of the local folder are used in place
+    if url.startswith("file://"):
+        filepath = url.removeprefix("file://")
+        if not os.path.exists(filepath):
+            raise FileNotFoundError(f"Image '{filepath}' does not exist anymore")
+        return filepath
+
+    cache = get_cache()
+
+    filepath = cache.lookup(url)
+    if filepath:
+        return filepath
+
+    import hashlib
+    import requests
+
+    with _url_lock(url):
+        # Same URL may have been downloaded while waiting for the lock
+        filepath = cache.lookup(url)
+        if filepath:
+            return filepath
+
+        dir_ = get_download_directory()
+        part_path = os.path.join(
+            dir_, f"{hashlib.sha256(url.encode('utf-8')).hexdigest()}.part"
+        )
+
+        attempts = program_data.network.get("retries", 3) + 1
+        for attempt in range(attempts):
+            try:
+                _download_part(url, part_path, progress, chunk_size)
+                break
+            except (
+                requests.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+                IncompleteDownloadError,
+            ):
+                if attempt == attempts - 1:
+                    raise
+            except UnsuitableImageError:
+                for path in (part_path, f"{part_path}.json"):
+                    if os.path.exists(path):
+                        os.remove(path)
+                raise
+
+        if program_data.image.get("downscale"):
+            downscale_image(part_path)
+
+        # Complete image is renamed into place, a partial one is never visible
+        content_hash = _file_hash(part_path).hexdigest()
+        filepath = os.path.join(dir_, f"{content_hash}.jpg")
+        os.replace(part_path, filepath)
+        os.remove(f"{part_path}.json")
+
+    cache.add(url, filepath, content_hash, metadata)
+    evict_cache(keep={filepath})
+
+    return filepath
+
+
+def _download_part(url: str, part_path: str, progress, chunk_size: int) -> None:
+    """Downloads image to the .part file, resuming it if validators allow."""
+    validators_path = f"{part_path}.json"
+    validators = None
+    offset = 0
+
+    if os.path.exists(part_path) and os.path.exists(validators_path):
+        with open(validators_path, "r") as validators_file:
+            validators = json.load(validators_file)
+        offset = os.path.getsize(part_path)
+
+    # Part left complete by an interrupted rename
+    if validators and offset and offset == validators["length"]:
+        return
+
+    headers = {}
+    if offset:
+        headers["Range"] = f"bytes={offset}-"
+        validator = validators.get("etag") or validators.get("last_modified")
+        if validator:
+            headers["If-Range"] = validator
+
+    with http_get(url, stream=True, headers=headers) as response:
+        if response.status_code == 416:
+            os.remove(part_path)
+            raise IncompleteDownloadError("Partial download is not valid anymore")
+
+        if response.status_code == 206:
+            # Range the part does not end at, e.g. from a proxy, starts over
+            if not offset or content_range_start(response) != offset:
+                if os.path.exists(part_path):
+                    os.remove(part_path)
+                raise IncompleteDownloadError("Partial response does not fit the part")
+
+            mode = "ab"
+            probe = None
+        else:
+            # Server sent whole image, start from the beginning
+            _check_image_response(response)
+            offset = 0
+            mode = "wb"
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "length": int(response.headers.get("Content-Length", 0)),
+            }
+            with open(validators_path, "w") as validators_file:
+                json.dump(validators, validators_file)
+
+            # Read image header from the first chunks before going on
+            check_image_suitable(validators["length"])
+            probe = b""
+
+        total = validators["length"]
+        received = offset
+
+        with open(part_path, mode) as part_file:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if probe is not None:
+                    probe += chunk
+                    probed = imageinfo.probe_image_size(probe)
+                    if probed or len(probe) >= PROBE_LIMIT:
+                        check_image_suitable(total, probed)
+                        probe = None
+
+                part_file.write(chunk)
+                received += len(chunk)
+                if progress:
+                    progress(received, total)
+
+            part_file.flush()
+            os.fsync(part_file.fileno())
+
+    if total and received != total:
+        raise IncompleteDownloadError(f"Received {received} of {total} bytes")
+
+
+def content_range_start(response: requests.Response) -> int | None:
+    """Returns first byte position of the Content-Range header, None if invalid."""
+    unit, _, byte_range = response.headers.get("Content-Range", "").partition(" ")
+    start, _, _ = byte_range.partition("-")
+    if unit != "bytes" or not start.isdigit():
+        return None
+
+    return int(start)
+
+
+def _file_hash(filepath: str):
+    """Returns sha256 hash object of the file content."""
+    import hashlib
+
+    content_hash = hashlib.sha256()
+    with open(filepath, "rb") as image_file:
+        for chunk in iter(lambda: image_file.read(65536), b""):
+            content_hash.update(chunk)
+
+    return content_hash
@@ -0,0 +1,214 @@
+import json
+import os
+import selectors
+import socket
+import sys
+import threading
+import time
+
+import core
+
+# Seconds a control client has to send its command
+CLIENT_TIMEOUT = 1
+# Seconds between attempts to top up a short queue, e.g. while the system is busy
+PREFETCH_RETRY = 60
+
+
+class DaemonRunningError(Exception):
+    pass
+
+
+def socket_path() -> str:
+    """Returns location of the daemon control socket."""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(runtime_dir, f"wallpaper-ed-{os.getuid()}.sock")
+
+
+def is_running() -> bool:
+    """Returns True if a daemon answers on the control socket."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(CLIENT_TIMEOUT)
+        try:
+            client.connect(socket_path())
+        except OSError:
+            return False
+
+    return True
+
+
+class RotationDaemon:
+    """Rotates wallpaper on a schedule from images downloaded ahead of time."""
+
+    def __init__(self, query: str = ""):
+        self.query = query
+        self.interval = core.program_data.rotation.get("interval", 30) * 60
+        self.ahead = core.program_data.rotation.get("ahead", 2)
+        self.paused = False
+        self.running = False
+        self.next_rotation = time.monotonic()
+        self.last_error = None
+        self._prefetch_thread = None
+        # Rotation queue is changed from the loop and prefetch thread
+        self._queue_lock = threading.Lock()
+
+    def reload_config(self) -> None:
+        """Picks up config changes saved by the GUI or edited by hand."""
+        if not core.program_data.reload_if_changed():
+            return
+
+        self.interval = core.program_data.rotation.get("interval", 30) * 60
+        self.ahead = core.program_data.rotation.get("ahead", 2)
+
+    def queue(self) -> list[str]:
+        """Returns images waiting for rotation."""
+        return core.get_cache().get_state("rotation_queue", [])
+
+    def rotate(self) -> None:
+        """Sets next image as wallpaper and tops up the queue in background."""
+        cache = core.get_cache()
+        current = cache.get_state("current_wallpaper")
+
+        # Prefer fresh images, otherwise cycle through the cached ones
+        with self._queue_lock:
+            queue = [path for path in self.queue() if os.path.exists(path)]
+            filepath = queue.pop(0) if queue else None
+            cache.set_state("rotation_queue", queue)
+        if filepath is None:
+            filepath = cache.least_recently_used({current})
+
+        if filepath:
+            try:
+                core.set_wallpaper(filepath)
+                self.last_error = None
+            except Exception as ex:
+                self.last_error = str(ex)
+                print(f"wallpaper-ed: {ex}", file=sys.stderr)
+
+        self.next_rotation = time.monotonic() + self.interval
+        self.prefetch()
+
+    def is_idle(self) -> bool:
+        """Returns True if the system is not busy."""
+        return os.getloadavg()[0] < (os.cpu_count() or 1)
+
+    def needs_prefetch(self) -> bool:
+        """Returns True if the queue holds fewer images than configured."""
+        return len(self.queue()) < self.ahead
+
+    def prefetch(self) -> None:
+        """Downloads images ahead of schedule if the queue runs low."""
+        missing = self.ahead - len(self.queue())
+        if missing <= 0 or not self.is_idle():
+            return
+        if self._prefetch_thread is not None and self._prefetch_thread.is_alive():
+            return
+
+        self._prefetch_thread = threading.Thread(
+            target=self._prefetch_images, args=(missing,), daemon=True
+        )
+        self._prefetch_thread.start()
+
+    def _prefetch_images(self, count: int) -> None:
+        try:
+            with core.background_requests():
+                filepaths = core.fetch_images(self.query, count=count)
+        except Exception as ex:
+            self.last_error = str(ex)
+            return
+
+        with self._queue_lock:
+            queue = self.queue()
+            core.get_cache().set_state("rotation_queue", queue + filepaths)
+
+    def status(self) -> dict:
+        """Returns daemon state reported to control clients."""
+        return {
+            "query": self.query,
+            "paused": self.paused,
+            "current": core.get_cache().get_state("current_wallpaper"),
+            "queued": len(self.queue()),
+            "next_rotation_in": max(0, round(self.next_rotation - time.monotonic())),
+            "last_error": self.last_error,
+        }
+
+    def handle_command(self, command: str) -> dict:
+        """Executes control command. Returns response for the client."""
+        if command == "next":
+            self.rotate()
+        elif command == "pause":
+            self.paused = True
+        elif command == "resume":
+            self.paused = False
+            self.next_rotation = time.monotonic() + self.interval
+        elif command == "stop":
+            self.running = False
+        elif command != "status":
+            return {"error": f"Unknown command '{command}'"}
+
+        return self.status()
+
+    def handle_client(self, server: socket.socket) -> None:
+        connection, _ = server.accept()
+        with connection:
+            connection.settimeout(CLIENT_TIMEOUT)
+            try:
+                command = connection.makefile().readline().strip()
+                response = self.handle_command(command)
+                connection.sendall(json.dumps(response).encode("utf-8") + b"\n")
+            except OSError:
+                pass
+
+    def serve_forever(self) -> None:
+        """Runs rotation loop until stopped through the control socket."""
+        path = socket_path()
+        if os.path.exists(path):
+            if is_running():
+                raise DaemonRunningError(f"Daemon is already running on {path}")
+
+            # Socket left behind by a daemon that did not exit cleanly
+            os.remove(path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        os.chmod(path, 0o600)
+        server.listen()
+
+        self.running = True
+        try:
+            with selectors.DefaultSelector() as selector:
+                selector.register(server, selectors.EVENT_READ)
+
+                while self.running:
+                    self.reload_config()
+
+                    # Sleep until next rotation or control command
+                    timeout = None
+                    if not self.paused:
+                        timeout = max(0, self.next_rotation - time.monotonic())
+
+                    # Retry topping up a short queue before the next rotation
+                    if self.needs_prefetch():
+                        timeout = (
+                            PREFETCH_RETRY
+                            if timeout is None
+                            else min(timeout, PREFETCH_RETRY)
+                        )
+
+                    if selector.select(timeout):
+                        self.handle_client(server)
+                    elif not self.paused and time.monotonic() >= self.next_rotation:
+                        self.rotate()
+                    else:
+                        self.prefetch()
+        finally:
+            server.close()
+            os.remove(path)
+
+
+def send_command(command: str) -> dict:
+    """Sends control command to the running daemon. Returns its response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(CLIENT_TIMEOUT + 30)
+        client.connect(socket_path())
+        client.sendall(command.encode("utf-8") + b"\n")
+        return json.loads(client.makefile().readline())
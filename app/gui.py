@@ -0,0 +1,766 @@
+import os
+import time
+import threading
+import core
+from config import AppConfig
+from history import PreviewHistory
+from PyQt6.QtWidgets import (
+    QMainWindow,
+    QApplication,
+    QMessageBox,
+    QLineEdit,
+    QCheckBox,
+    QGraphicsScene,
+    QLabel,
+    QToolButton,
+)
+from PyQt6.QtCore import (
+    Qt,
+    QThread,
+    pyqtSignal,
+    QObject,
+    QBuffer,
+    QByteArray,
+    QSize,
+    QTimer,
+    QSignalBlocker,
+    QRunnable,
+    QThreadPool,
+)
+from PyQt6.QtGui import QPixmap, QImage, QImageReader, QKeySequence
+from app_ui import Ui_MainWindow
+
+
+def decode_preview(source: str | bytes, size: QSize) -> QImage:
+    """Decodes image file or data scaled down to fit the given size."""
+
+    if isinstance(source, bytes):
+        buffer = QBuffer()
+        buffer.setData(QByteArray(source))
+        buffer.open(QBuffer.OpenModeFlag.ReadOnly)
+        reader = QImageReader(buffer)
+    else:
+        reader = QImageReader(source)
+    reader.setAutoTransform(True)
+
+    # Let decoder produce view-sized image instead of scaling full resolution one
+    image_size = reader.size()
+    if image_size.isValid() and (
+        image_size.width() > size.width() or image_size.height() > size.height()
+    ):
+        reader.setScaledSize(
+            image_size.scaled(size, Qt.AspectRatioMode.KeepAspectRatio)
+        )
+
+    return reader.read()
+
+
+class ImageDownloadCancelled(Exception):
+    """Raised inside the download task to abort a superseded request."""
+
+
+class ImageDownloadSignals(QObject):
+    thumbnail_ready = pyqtSignal(int, str, QImage)  # generation, url, thumbnail
+    progress = pyqtSignal(int, int, int)  # generation, received, total bytes
+    finished = pyqtSignal(int, str, str, QImage)  # generation, url, filepath, preview
+    error = pyqtSignal(int, str)  # generation, error message
+    done = pyqtSignal(int)  # generation, emitted last in any case
+
+
+class ImageDownloadTask(QRunnable):
+    """Fetches next image for the query in the preview thread pool."""
+
+    def __init__(self, generation, query, preview_size):
+        super().__init__()
+        # Window keeps the task until it is done
+        self.setAutoDelete(False)
+        self.signals = ImageDownloadSignals()
+        self.generation = generation
+        self.query = query
+        self.preview_size = preview_size
+        self._cancel_requested = False
+
+    def cancel(self):
+        """Requests cancellation, checked before requests and between chunks."""
+        self._cancel_requested = True
+
+    def check_cancelled(self):
+        if self._cancel_requested:
+            raise ImageDownloadCancelled()
+
+    def on_progress(self, received, total):
+        self.check_cancelled()
+        self.signals.progress.emit(self.generation, received, total)
+
+    def on_thumbnail(self, url, thumbnail_data):
+        self.check_cancelled()
+        self.signals.thumbnail_ready.emit(
+            self.generation, url, decode_preview(thumbnail_data, self.preview_size)
+        )
+
+    def run(self):
+        try:
+            self.check_cancelled()
+            url, filepath = core.get_image(
+                self.query,
+                progress=self.on_progress,
+                thumbnail=self.on_thumbnail,
+            )
+            self.check_cancelled()
+            self.signals.finished.emit(
+                self.generation,
+                url,
+                filepath,
+                decode_preview(filepath, self.preview_size),
+            )
+        except ImageDownloadCancelled:
+            pass
+        except Exception as ex:
+            self.signals.error.emit(self.generation, str(ex))
+        finally:
+            self.signals.done.emit(self.generation)
+
+
+class PreviewDecodeWorker(QObject):
+    finished = pyqtSignal(str, QImage)  # filepath, preview
+
+    def __init__(self, filepath, preview_size):
+        super().__init__()
+        self.filepath = filepath
+        self.preview_size = preview_size
+
+    def run(self):
+        self.finished.emit(
+            self.filepath, decode_preview(self.filepath, self.preview_size)
+        )
+
+
+class SetWallpaperCancelled(Exception):
+    """Raised inside the set wallpaper job to abort a running download."""
+
+
+class SetWallpaperWorker(QObject):
+    progress = pyqtSignal(int, str)  # percent, stage description
+    finished = pyqtSignal(str, float)  # filepath, apply time in seconds
+    cancelled = pyqtSignal()
+    error = pyqtSignal(str)
+
+    def __init__(self, url, filepath=None):
+        super().__init__()
+        self.url = url
+        self.filepath = filepath
+        self._cancel_requested = False
+
+    def cancel(self):
+        """Requests cancellation, checked between stages and download chunks."""
+        self._cancel_requested = True
+
+    def on_download_progress(self, received, total):
+        if self._cancel_requested:
+            raise SetWallpaperCancelled()
+        if total:
+            self.progress.emit(received * 90 // total, "Downloading image...")
+
+    def run(self):
+        try:
+            # Download image only if the preview file is not available
+            if not self.filepath or not os.path.exists(self.filepath):
+                self.progress.emit(0, "Downloading image...")
+                self.filepath = core.download_image(
+                    self.url, progress=self.on_download_progress
+                )
+
+            if self._cancel_requested:
+                self.cancelled.emit()
+                return
+
+            self.progress.emit(90, "Applying wallpaper...")
+            elapsed = core.set_wallpaper(filepath=self.filepath)
+            self.progress.emit(100, "Wallpaper set!")
+            self.finished.emit(self.filepath, elapsed)
+        except SetWallpaperCancelled:
+            self.cancelled.emit()
+        except Exception as ex:
+            self.error.emit(str(ex))
+
+
+class WallpaperED(QMainWindow):
+
+    def __init__(self, program_data: AppConfig) -> None:
+        super(WallpaperED, self).__init__()
+
+        self.__program_data = program_data
+        # self.setStyleSheet(stylesheet)
+
+        # Setup UI
+        self.ui = Ui_MainWindow()
+        self.ui.setupUi(self)
+        self.scene = QGraphicsScene(self)
+
+        # Fetch images sized for the physical screen resolution
+        screen = QApplication.primaryScreen()
+        if screen:
+            ratio = screen.devicePixelRatio()
+            core.set_screen_resolution(
+                round(screen.size().width() * ratio),
+                round(screen.size().height() * ratio),
+            )
+
+        # Setup tooltips for buttons
+        self.ui.setWallpaperButton.setToolTip(
+            self.ui.setWallpaperButton.shortcut().toString()
+        )
+        self.ui.getWallpaperButton.setToolTip(
+            self.ui.getWallpaperButton.shortcut().toString()
+        )
+        self.ui.applySettingsButton.setToolTip(
+            self.ui.applySettingsButton.shortcut().toString()
+        )
+        self.ui.resetSettingsButton.setToolTip(
+            self.ui.resetSettingsButton.shortcut().toString()
+        )
+        self.ui.showAPITokenButton.setToolTip(
+            self.ui.showAPITokenButton.shortcut().toString()
+        )
+
+        # Back and forward through fetched images, next to the query
+        self.backButton = QToolButton(parent=self.ui.centralwidget)
+        self.backButton.setArrowType(Qt.ArrowType.LeftArrow)
+        self.backButton.setShortcut(QKeySequence(QKeySequence.StandardKey.Back))
+        self.backButton.setToolTip(self.backButton.shortcut().toString())
+        self.forwardButton = QToolButton(parent=self.ui.centralwidget)
+        self.forwardButton.setArrowType(Qt.ArrowType.RightArrow)
+        self.forwardButton.setShortcut(QKeySequence(QKeySequence.StandardKey.Forward))
+        self.forwardButton.setToolTip(self.forwardButton.shortcut().toString())
+        self.ui.horizontalLayout.insertWidget(0, self.backButton)
+        self.ui.horizontalLayout.insertWidget(1, self.forwardButton)
+
+        # Cancels the running set wallpaper job, shown only while it runs
+        self.cancelSetButton = QToolButton(parent=self)
+        self.cancelSetButton.setText("Cancel")
+        self.cancelSetButton.setShortcut(QKeySequence(Qt.Key.Key_Escape))
+        self.cancelSetButton.setToolTip(self.cancelSetButton.shortcut().toString())
+        self.cancelSetButton.hide()
+        self.statusBar().addPermanentWidget(self.cancelSetButton)
+
+        # APIs missing in the designer form and searching all of them at once
+        for api_name in [*self.__program_data.apis, core.ANY_API]:
+            if self.ui.APIComboBox.findText(api_name) < 0:
+                self.ui.APIComboBox.addItem(api_name)
+
+        # Connect slots to methods
+        self.ui.getWallpaperButton.clicked.connect(self.getWallpaperButtonClicked)
+        self.ui.setWallpaperButton.clicked.connect(self.setWallpaperButtonClicked)
+        self.ui.applySettingsButton.clicked.connect(self.applySettingsButtonClicked)
+        self.ui.resetSettingsButton.clicked.connect(self.resetSettingsButtonClicked)
+        self.ui.showAPITokenButton.clicked.connect(self.showAPITokenButtonClicked)
+        self.backButton.clicked.connect(self.backButtonClicked)
+        self.forwardButton.clicked.connect(self.forwardButtonClicked)
+        self.cancelSetButton.clicked.connect(self.cancelSetButtonClicked)
+        self.ui.APIComboBox.currentTextChanged.connect(self.loadConfigToGUI)
+        self.ui.imageOrientationComboBox.currentTextChanged.connect(
+            self.loadConfigToGUI
+        )
+
+        for index in range(self.ui.purityLayout.count()):
+            item = self.ui.purityLayout.itemAt(index)
+            widget: QCheckBox = item.widget()
+            widget.checkStateChanged.connect(self.loadConfigToGUI)
+
+        self.loadConfigToGUI()
+
+        # API budget and latency readout in the settings tab
+        self.apiBudgetLabel = QLabel(parent=self.ui.groupBox)
+        self.ui.verticalLayout_3.addWidget(self.apiBudgetLabel)
+        self.ui.tabWidget.currentChanged.connect(self.updateAPIBudgetLabel)
+        self.updateAPIBudgetLabel()
+
+        # Set current image as None
+        self.current_image = None
+        self.current_image_path = None
+        self.original_pixmap = None
+
+        # Fetched images with their previews kept within the memory budget
+        self.history = PreviewHistory(
+            max_bytes=self.__program_data.history.get(
+                "preview_bytes", 64 * 1024 * 1024
+            ),
+            max_entries=self.__program_data.history.get("entries", 200),
+        )
+        self.updateHistoryButtons()
+
+        # Preview fetches, only the latest request reaches the scene
+        self.fetch_pool = QThreadPool(self)
+        self.fetch_pool.setMaxThreadCount(2)
+        self.fetch_generation = 0
+        self.fetch_tasks = {}
+
+        # Re-decode preview after resizing settles if it became too small
+        self.decode_thread = None
+        self.decode_worker = None
+        # Image decoded once the running decode finishes
+        self.pending_decode = None
+        self.resize_timer = QTimer(self)
+        self.resize_timer.setSingleShot(True)
+        self.resize_timer.setInterval(200)
+        self.resize_timer.timeout.connect(self.redecodePreview)
+
+        # Settings changed by widgets are written once they stop changing
+        self.config_save_timer = QTimer(self)
+        self.config_save_timer.setSingleShot(True)
+        self.config_save_timer.setInterval(500)
+        self.config_save_timer.timeout.connect(self.__program_data.flush_config)
+
+        # Settings saved by the daemon or edited by hand are shown when noticed
+        self.config_reload_timer = QTimer(self)
+        self.config_reload_timer.setInterval(2000)
+        self.config_reload_timer.timeout.connect(self.reloadConfig)
+        self.config_reload_timer.start()
+
+        # Next login wallpaper is staged after setting one
+        self.stage_thread = None
+
+        # Set wallpaper job, only one is allowed to run at a time
+        self.set_thread = None
+        self.set_worker = None
+
+    def showAPITokenButtonClicked(self):
+        if self.ui.apiTokenEdit.echoMode() == QLineEdit.EchoMode.Password:
+            self.ui.apiTokenEdit.setEchoMode(QLineEdit.EchoMode.Normal)
+        else:
+            self.ui.apiTokenEdit.setEchoMode(QLineEdit.EchoMode.Password)
+
+    def showErrorMessage(self, title: str, description: str, details: str) -> None:
+        """Shows the error message."""
+
+        err_msg = QMessageBox()
+        err_msg.setIcon(QMessageBox.Icon.Critical)
+        err_msg.setWindowTitle(title)
+        err_msg.setText(description)
+        err_msg.setDetailedText(details)
+        err_msg.exec()
+
+    def getPurityOptions(self):
+
+        options = ""
+
+        for index in range(self.ui.purityLayout.count()):
+
+            item = self.ui.purityLayout.itemAt(index)
+            widget: QCheckBox = item.widget()
+
+            options += str(int(widget.isChecked()))
+
+        return options
+
+    def loadConfigToGUI(self, flag=None):
+
+        if flag:
+            self.__program_data.selected_api = self.ui.APIComboBox.currentText()
+            self.__program_data.image["orientation"] = (
+                self.ui.imageOrientationComboBox.currentText()
+            )
+            self.__program_data.image["purity"] = self.getPurityOptions()
+            self.__program_data.mark_dirty()
+            self.config_save_timer.start()
+
+        # Widgets are only updated here, their change signals must not write back
+        blockers = [
+            QSignalBlocker(self.ui.APIComboBox),
+            QSignalBlocker(self.ui.imageOrientationComboBox),
+        ]
+        purity = self.__program_data.image.get("purity", "")
+        for index in range(self.ui.purityLayout.count()):
+            widget: QCheckBox = self.ui.purityLayout.itemAt(index).widget()
+            blockers.append(QSignalBlocker(widget))
+            if index < len(purity):
+                widget.setChecked(purity[index] == "1")
+
+        self.ui.APIComboBox.setCurrentText(self.__program_data.selected_api)
+        self.ui.downloadDirectoryEdit.setText(self.__program_data.download_directory)
+        # Local folder and "any" have no token of their own
+        api_config = self.__program_data.apis.get(self.__program_data.selected_api)
+        api_token = (api_config or {}).get("api_token")
+        self.ui.apiTokenEdit.setEnabled(api_token is not None)
+        self.ui.apiTokenEdit.setText(api_token or "")
+
+        commands = self.__program_data.execute
+
+        commands = "\n".join(commands)
+        self.ui.wallpaperCommandEdit.setText(commands)
+        self.ui.imageOrientationComboBox.setCurrentText(
+            self.__program_data.image["orientation"]
+        )
+
+    def reloadConfig(self):
+        if self.__program_data.reload_if_changed():
+            self.loadConfigToGUI()
+            self.updateAPIBudgetLabel()
+
+    def closeEvent(self, event):
+        self.__program_data.flush_config()
+        super().closeEvent(event)
+
+    def applySettingsButtonClicked(self):
+
+        # Read values from user input
+        download_directory = self.ui.downloadDirectoryEdit.text().lstrip()
+        api_token = self.ui.apiTokenEdit.text().lstrip()
+        wallpaper_commands = self.ui.wallpaperCommandEdit.toPlainText()
+        wallpaper_commands = wallpaper_commands.split("\n")
+        wallpaper_commands = list(filter(lambda cmd: cmd.lstrip(), wallpaper_commands))
+
+        if download_directory:
+            self.__program_data.download_directory = download_directory
+
+        # Tokens are set per API, "any" uses the tokens of all of them
+        api_config = self.__program_data.apis.get(self.ui.APIComboBox.currentText())
+        if api_config is not None and "api_token" in api_config:
+            api_config["api_token"] = api_token
+
+        if wallpaper_commands:
+            self.__program_data.execute = wallpaper_commands
+
+        self.__program_data.write_config()
+
+    def updateAPIBudgetLabel(self):
+        api_names = [self.__program_data.selected_api]
+        if api_names[0] == core.ANY_API:
+            api_names = list(self.__program_data.apis)
+
+        lines = []
+        for api_name in api_names:
+            budget = core.get_rate_limit(api_name)
+
+            # Local folder sends no requests
+            if not budget["limit"] and budget["latency"] is None:
+                continue
+
+            text = (
+                f"{api_name} budget: {budget['remaining']}/{budget['limit']}"
+                " requests left"
+            )
+            if budget["reset_at"]:
+                resets_in = max(0, round(budget["reset_at"] - time.time()))
+                text += f", resets in {resets_in} s"
+            if budget["latency"] is not None:
+                text += f", average latency {budget['latency'] * 1000:.0f} ms"
+            lines.append(text)
+
+        self.apiBudgetLabel.setText("\n".join(lines))
+
+    def resetSettingsButtonClicked(self):
+        self.loadConfigToGUI()
+
+    def getWallpaperButtonClicked(self):
+        query = self.ui.imageQueryEdit.text().lstrip()
+
+        # Same query is already being fetched, its result will be shown
+        latest = self.fetch_tasks.get(self.fetch_generation)
+        if latest is not None and latest.query == query:
+            return
+
+        # Newer request supersedes all older ones
+        for task in self.fetch_tasks.values():
+            task.cancel()
+
+        self.fetch_generation += 1
+        task = ImageDownloadTask(self.fetch_generation, query, self.previewSize())
+
+        # Connect signals
+        task.signals.thumbnail_ready.connect(self.on_thumbnail_downloaded)
+        task.signals.progress.connect(self.on_image_download_progress)
+        task.signals.finished.connect(self.on_image_downloaded)
+        task.signals.error.connect(self.on_image_download_error)
+        task.signals.done.connect(self.cleanup_fetch_task)
+
+        self.fetch_tasks[self.fetch_generation] = task
+        self.fetch_pool.start(task)
+
+    def cleanup_fetch_task(self, generation):
+        """Releases finished or cancelled fetch task"""
+        self.fetch_tasks.pop(generation, None)
+
+    def on_image_download_progress(self, generation, received, total):
+        if generation == self.fetch_generation and total:
+            self.statusBar().showMessage(
+                f"Downloading image... ({received * 100 // total}%)"
+            )
+
+    def on_thumbnail_downloaded(self, generation, url, thumbnail):
+        if generation != self.fetch_generation:
+            return
+
+        # Show thumbnail while full image is downloading,
+        # clicking Set before it arrives downloads the full image itself
+        self.current_image = url
+        self.current_image_path = None
+        self.show_preview(thumbnail)
+
+    def on_image_downloaded(self, generation, url, filepath, preview):
+        if generation != self.fetch_generation:
+            return
+
+        self.statusBar().clearMessage()
+        self.current_image = url
+        # Keep downloaded file so setting wallpaper needs no network round-trip
+        self.current_image_path = filepath
+        self.show_preview(preview)
+
+        self.history.push(url, filepath)
+        self.history.store_preview(filepath, preview, preview.sizeInBytes())
+        self.updateHistoryButtons()
+
+    def backButtonClicked(self):
+        self.showHistoryEntry(self.history.back())
+
+    def forwardButtonClicked(self):
+        self.showHistoryEntry(self.history.forward())
+
+    def showHistoryEntry(self, entry):
+        """Shows image from history without any request."""
+        if entry is None:
+            return
+
+        # Pending fetch must not replace the image picked from history
+        for task in self.fetch_tasks.values():
+            task.cancel()
+        self.fetch_generation += 1
+        self.statusBar().clearMessage()
+
+        url, filepath = entry
+        preview = self.history.preview(filepath)
+
+        # File may have been evicted from the download directory
+        if preview is None and not os.path.exists(filepath):
+            self.history.remove_current()
+            self.updateHistoryButtons()
+            self.statusBar().showMessage("Image is no longer downloaded", 5000)
+            return
+
+        # Browsed images are kept in the download directory longer
+        core.get_cache().touch(filepath)
+
+        self.current_image = url
+        self.current_image_path = filepath
+        self.updateHistoryButtons()
+
+        if preview is not None:
+            self.show_preview(preview)
+        else:
+            # Preview was evicted from memory, it replaces the shown one when decoded
+            self.startPreviewDecode(filepath)
+
+    def updateHistoryButtons(self):
+        self.backButton.setEnabled(self.history.can_go_back())
+        self.forwardButton.setEnabled(self.history.can_go_forward())
+
+    def previewSize(self) -> QSize:
+        """Returns preview area size in physical pixels."""
+        ratio = self.ui.imageArea.devicePixelRatioF()
+        size = self.ui.imageArea.viewport().size()
+        return QSize(round(size.width() * ratio), round(size.height() * ratio))
+
+    def show_preview(self, image):
+        """Replaces image shown in the preview area."""
+        self.original_pixmap = QPixmap().fromImage(image)
+        self.scene.clear()
+        self.scene.addPixmap(self.original_pixmap)
+        self.scene.setSceneRect(
+            0, 0, self.original_pixmap.width(), self.original_pixmap.height()
+        )
+        self.ui.imageArea.setScene(self.scene)
+        self.ui.imageArea.fitInView(
+            self.scene.sceneRect(), Qt.AspectRatioMode.KeepAspectRatio
+        )
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+
+        if self.original_pixmap is not None:
+            self.ui.imageArea.fitInView(
+                self.scene.sceneRect(), Qt.AspectRatioMode.KeepAspectRatio
+            )
+            self.resize_timer.start()
+
+    def redecodePreview(self):
+        """Decodes preview again in background if it is smaller than the view."""
+        if not self.current_image_path or self.original_pixmap is None:
+            return
+
+        # Wait for running decode to finish
+        if self.decode_thread is not None:
+            self.resize_timer.start()
+            return
+
+        size = self.previewSize()
+        image_size = QImageReader(self.current_image_path).size()
+        fitted = image_size.scaled(size, Qt.AspectRatioMode.KeepAspectRatio)
+        if self.original_pixmap.width() >= min(image_size.width(), fitted.width()):
+            return
+
+        self.startPreviewDecode(self.current_image_path)
+
+    def startPreviewDecode(self, filepath):
+        """Decodes view-sized preview of the image in background."""
+        if self.decode_thread is not None:
+            self.pending_decode = filepath
+            return
+
+        self.decode_thread = QThread()
+        self.decode_worker = PreviewDecodeWorker(filepath, self.previewSize())
+        self.decode_worker.moveToThread(self.decode_thread)
+        self.decode_thread.started.connect(self.decode_worker.run)
+        self.decode_worker.finished.connect(self.on_preview_decoded)
+        self.decode_worker.finished.connect(self.cleanup_decode_thread)
+        self.decode_thread.start()
+
+    def cleanup_decode_thread(self):
+        """Clean up preview decode thread resources"""
+        self.decode_thread.quit()
+        self.decode_thread.wait()
+        self.decode_worker.deleteLater()
+        self.decode_thread.deleteLater()
+        self.decode_thread = None
+        self.decode_worker = None
+
+        # Only the image still shown is worth decoding, unless it already was
+        filepath, self.pending_decode = self.pending_decode, None
+        if (
+            filepath is not None
+            and filepath == self.current_image_path
+            and self.history.preview(filepath) is None
+        ):
+            self.startPreviewDecode(filepath)
+
+    def on_preview_decoded(self, filepath, preview):
+        # Ignore previews of images replaced in the meantime
+        if filepath == self.current_image_path:
+            self.show_preview(preview)
+            self.history.store_preview(filepath, preview, preview.sizeInBytes())
+
+    def on_image_download_error(self, generation, error_msg):
+        if generation != self.fetch_generation:
+            return
+
+        self.statusBar().clearMessage()
+        self.showErrorMessage(
+            title="Error!",
+            description="An error occurred while program execution!",
+            details=error_msg,
+        )
+        # Reset current image to prevent using invalid URL
+        self.current_image = None
+        self.current_image_path = None
+
+    def setWallpaperButtonClicked(self):
+
+        # Repeated clicks, e.g. a double click, must not start another job
+        if self.set_worker is not None:
+            return
+
+        if self.current_image:
+            self.ui.setWallpaperButton.setEnabled(False)
+            self.cancelSetButton.show()
+
+            # Fetch, save and apply wallpaper in a background thread
+            self.set_thread = QThread()
+            self.set_worker = SetWallpaperWorker(
+                self.current_image, self.current_image_path
+            )
+            self.set_worker.moveToThread(self.set_thread)
+            self.set_thread.started.connect(self.set_worker.run)
+
+            # Connect signals
+            self.set_worker.progress.connect(self.on_set_wallpaper_progress)
+            self.set_worker.finished.connect(self.on_wallpaper_set)
+            self.set_worker.cancelled.connect(self.on_set_wallpaper_cancelled)
+            self.set_worker.error.connect(self.on_set_wallpaper_error)
+
+            # Cleanup for success, cancellation and error cases
+            self.set_worker.finished.connect(self.cleanup_set_thread)
+            self.set_worker.cancelled.connect(self.cleanup_set_thread)
+            self.set_worker.error.connect(self.cleanup_set_thread)
+
+            self.set_thread.start()
+
+    def cancelSetButtonClicked(self):
+        if self.set_worker is not None:
+            self.set_worker.cancel()
+            self.statusBar().showMessage("Cancelling...")
+
+    def cleanup_set_thread(self):
+        """Clean up set wallpaper thread resources"""
+        self.ui.setWallpaperButton.setEnabled(True)
+        self.cancelSetButton.hide()
+
+        # Keep file downloaded by the job for the next Set click
+        if self.set_worker.url == self.current_image:
+            self.current_image_path = self.set_worker.filepath
+
+        self.set_thread.quit()
+        self.set_thread.wait()
+        self.set_worker.deleteLater()
+        self.set_thread.deleteLater()
+        self.set_thread = None
+        self.set_worker = None
+
+    def on_set_wallpaper_progress(self, percent, stage):
+        self.statusBar().showMessage(f"{stage} ({percent}%)")
+
+    def on_wallpaper_set(self, filepath, elapsed):
+        self.statusBar().showMessage(
+            f"Wallpaper set in {elapsed * 1000:.0f} ms: {filepath}", 5000
+        )
+        self.stageLoginWallpaper()
+
+    def stageLoginWallpaper(self):
+        """Downloads wallpaper for the next login in background if none is staged."""
+        query = self.__program_data.autostart.get("query", "")
+        if not self.__program_data.autostart.get("stage"):
+            return
+        if self.stage_thread is not None and self.stage_thread.is_alive():
+            return
+
+        # Not a daemon thread, so closing the window lets staging finish
+        self.stage_thread = threading.Thread(
+            target=self._stage_login_wallpaper, args=(query,)
+        )
+        self.stage_thread.start()
+
+    @staticmethod
+    def _stage_login_wallpaper(query):
+        if core.has_staged_wallpaper(query):
+            return
+        try:
+            with core.background_requests():
+                core.stage_next_wallpaper(query)
+        except Exception:
+            # Login falls back to downloading the wallpaper
+            pass
+
+    def on_set_wallpaper_cancelled(self):
+        self.statusBar().showMessage("Setting wallpaper cancelled", 5000)
+
+    def on_set_wallpaper_error(self, error_msg):
+        self.statusBar().clearMessage()
+        self.showErrorMessage(
+            title="Error!",
+            description="An error occurred while program execution!",
+            details=error_msg,
+        )
+
+
+def run() -> int:
+    """Shows main window and runs the application event loop."""
+
+    core.init()
+
+    # Create application and main window instances
+    app = QApplication([])
+    main_window = WallpaperED(
+        program_data=core.program_data,
+    )
+
+    main_window.show()
+    return app.exec()
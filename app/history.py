@@ -0,0 +1,107 @@
+from collections import OrderedDict
+
+
+class PreviewHistory:
+    """Back and forward history of downloaded images with a preview cache."""
+
+    def __init__(self, max_bytes: int, max_entries: int = 200):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.entries: list[tuple[str, str]] = []
+        self.position = -1
+
+        # Least recently used previews keyed by file path with their size in
+        # bytes, evicted ones are decoded again from the file
+        self._previews: OrderedDict[str, tuple[object, int]] = OrderedDict()
+        self._preview_bytes = 0
+
+    def current(self) -> tuple[str, str] | None:
+        """Returns (url, path) of the shown entry, None if history is empty."""
+        return self.entries[self.position] if self.entries else None
+
+    def push(self, url: str, path: str) -> None:
+        """Adds image after the shown entry, dropping the forward entries."""
+        if self.current() == (url, path):
+            return
+
+        dropped = self.entries[self.position + 1 :]
+        del self.entries[self.position + 1 :]
+        self.entries.append((url, path))
+
+        if len(self.entries) > self.max_entries:
+            dropped += self.entries[: -self.max_entries]
+            del self.entries[: -self.max_entries]
+
+        # Previews of dropped entries are not needed anymore
+        remaining_paths = {entry_path for _, entry_path in self.entries}
+        for _, dropped_path in dropped:
+            if dropped_path not in remaining_paths:
+                self.forget_preview(dropped_path)
+
+        self.position = len(self.entries) - 1
+
+    def can_go_back(self) -> bool:
+        return self.position > 0
+
+    def can_go_forward(self) -> bool:
+        return self.position < len(self.entries) - 1
+
+    def back(self) -> tuple[str, str] | None:
+        """Moves to the previous entry. Returns it, None if there is none."""
+        if not self.can_go_back():
+            return None
+
+        self.position -= 1
+        return self.entries[self.position]
+
+    def forward(self) -> tuple[str, str] | None:
+        """Moves to the next entry. Returns it, None if there is none."""
+        if not self.can_go_forward():
+            return None
+
+        self.position += 1
+        return self.entries[self.position]
+
+    def remove_current(self) -> None:
+        """Removes the shown entry, e.g. when its file no longer exists."""
+        if not self.entries:
+            return
+
+        _, path = self.entries.pop(self.position)
+        self.forget_preview(path)
+        self.position = min(self.position, len(self.entries) - 1)
+
+    def preview(self, path: str):
+        """Returns cached preview of the image file, None if not cached."""
+        item = self._previews.get(path)
+        if item is None:
+            return None
+
+        self._previews.move_to_end(path)
+        return item[0]
+
+    def store_preview(self, path: str, preview, size: int) -> None:
+        """Caches preview of size bytes, evicting least recently used ones."""
+        self.forget_preview(path)
+
+        # Preview larger than the whole budget is never cached
+        if size > self.max_bytes:
+            return
+
+        self._previews[path] = (preview, size)
+        self._preview_bytes += size
+
+        while self._preview_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._previews.popitem(last=False)
+            self._preview_bytes -= evicted_size
+
+    def forget_preview(self, path: str) -> None:
+        """Removes preview of the image file from the cache."""
+        item = self._previews.pop(path, None)
+        if item is not None:
+            self._preview_bytes -= item[1]
+
+    @property
+    def preview_bytes(self) -> int:
+        """Returns size of the cached previews in bytes."""
+        return self._preview_bytes
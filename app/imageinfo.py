@@ -0,0 +1,96 @@
+import struct
+
+# JPEG start of frame markers carrying image dimensions
+JPEG_SOF_MARKERS = {
+    0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF
+}
+# JPEG markers without a length field
+JPEG_STANDALONE_MARKERS = {0x01, *range(0xD0, 0xDA)}
+
+
+def probe_image_size(data: bytes) -> tuple[str, int, int] | None:
+    """Returns (format, width, height) of JPEG, PNG or WebP data, None if unknown."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return _probe_png(data)
+    if data.startswith(b"\xff\xd8"):
+        return _probe_jpeg(data)
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return _probe_webp(data)
+
+    return None
+
+
+def _probe_png(data: bytes) -> tuple[str, int, int] | None:
+    # IHDR chunk always comes first
+    if len(data) < 24 or data[12:16] != b"IHDR":
+        return None
+
+    width, height = struct.unpack(">II", data[16:24])
+    return "png", width, height
+
+
+def _probe_jpeg(data: bytes) -> tuple[str, int, int] | None:
+    position = 2
+
+    while position + 4 <= len(data):
+        if data[position] != 0xFF:
+            return None
+
+        marker = data[position + 1]
+
+        # Skip fill bytes between markers
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker in JPEG_STANDALONE_MARKERS:
+            position += 2
+            continue
+
+        if marker in JPEG_SOF_MARKERS:
+            if position + 9 > len(data):
+                return None
+            height, width = struct.unpack(">HH", data[position + 5 : position + 9])
+            return "jpeg", width, height
+
+        (length,) = struct.unpack(">H", data[position + 2 : position + 4])
+        position += 2 + length
+
+    return None
+
+
+def _probe_webp(data: bytes) -> tuple[str, int, int] | None:
+    chunk = data[12:16]
+
+    # Lossy bitstream, key frame header holds 14 bit dimensions
+    if chunk == b"VP8 " and len(data) >= 30 and data[23:26] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", data[26:30])
+        return "webp", width & 0x3FFF, height & 0x3FFF
+
+    # Lossless bitstream, dimensions are packed in 28 bits
+    if chunk == b"VP8L" and len(data) >= 25 and data[20] == 0x2F:
+        bits = int.from_bytes(data[21:25], "little")
+        return "webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+
+    # Extended format, canvas size is stored in 24 bits
+    if chunk == b"VP8X" and len(data) >= 30:
+        width = int.from_bytes(data[24:27], "little") + 1
+        height = int.from_bytes(data[27:30], "little") + 1
+        return "webp", width, height
+
+    return None
+
+
+def probe_image_file(path: str, limit: int = 256 * 1024) -> tuple[str, int, int] | None:
+    """Returns (format, width, height) from the first limit bytes of the file."""
+    with open(path, "rb") as image_file:
+        data = image_file.read(16 * 1024)
+        probed = probe_image_size(data)
+
+        while probed is None and len(data) < limit:
+            chunk = image_file.read(min(len(data), limit - len(data)))
+            if not chunk:
+                break
+            data += chunk
+            probed = probe_image_size(data)
+
+    return probed
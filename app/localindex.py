@@ -0,0 +1,314 @@
+import json
+import os
+import random
+import threading
+
+import imageinfo
+from cache import ImageCache
+
+# File name extensions of indexed images
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+# Width to height ratio from which an image is landscape, its inverse portrait
+LANDSCAPE_ASPECT = 1.2
+
+
+def image_orientation(width: int, height: int) -> str:
+    """Returns orientation name matching the image dimensions."""
+    if not width or not height:
+        return "unknown"
+
+    aspect = width / height
+    if aspect >= LANDSCAPE_ASPECT:
+        return "landscape"
+    if aspect <= 1 / LANDSCAPE_ASPECT:
+        return "portrait"
+
+    return "squarish"
+
+
+class LocalImageIndex:
+    """Index of images in a local folder with their dimensions, kept in the cache."""
+
+    def __init__(self, cache: ImageCache):
+        self.cache = cache
+        # Only one update walks the folder at a time
+        self._update_lock = threading.Lock()
+
+        with cache.transaction() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS local_directories (
+                    path TEXT PRIMARY KEY,
+                    mtime INTEGER NOT NULL,
+                    subdirectories TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS local_images (
+                    path TEXT PRIMARY KEY,
+                    directory TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime INTEGER NOT NULL,
+                    width INTEGER NOT NULL,
+                    height INTEGER NOT NULL,
+                    orientation TEXT NOT NULL,
+                    position INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS local_images_directory
+                    ON local_images (directory);
+                -- Images of each orientation are numbered 0..n-1 without gaps
+                CREATE UNIQUE INDEX IF NOT EXISTS local_images_position
+                    ON local_images (orientation, position);
+                """)
+
+    def update(self, root: str) -> int:
+        """Brings index of the root folder up to date. Returns files probed."""
+        root = os.path.abspath(os.path.expanduser(root))
+        probed = 0
+
+        # Directories with unchanged mtime are not listed again, headers are
+        # read before their transaction so the cache is not locked meanwhile
+        with self._update_lock:
+            with self.cache.transaction() as connection:
+                known = {
+                    path: (mtime, json.loads(subdirectories))
+                    for path, mtime, subdirectories in connection.execute(
+                        "SELECT path, mtime, subdirectories FROM local_directories"
+                    )
+                }
+            visited = set()
+            pending = [root]
+
+            while pending:
+                directory = pending.pop()
+                try:
+                    mtime = os.stat(directory).st_mtime_ns
+                except OSError:
+                    continue
+                visited.add(directory)
+
+                # Unchanged directory has the same entries, only recurse
+                if directory in known and known[directory][0] == mtime:
+                    subdirectories = known[directory][1]
+                else:
+                    try:
+                        subdirectories, changed, removed = self._scan_directory(
+                            directory
+                        )
+                    except OSError:
+                        continue
+                    probed += len(changed)
+
+                    # Each directory is committed to keep progress of long scans
+                    with self.cache.transaction() as connection:
+                        for path in removed:
+                            self._remove_image(connection, path)
+                        for path, size, file_mtime, width, height in changed:
+                            self._remove_image(connection, path)
+                            self._add_image(
+                                connection,
+                                path,
+                                directory,
+                                size,
+                                file_mtime,
+                                width,
+                                height,
+                            )
+                        connection.execute(
+                            "INSERT OR REPLACE INTO local_directories"
+                            " (path, mtime, subdirectories) VALUES (?, ?, ?)",
+                            (directory, mtime, json.dumps(subdirectories)),
+                        )
+
+                pending.extend(os.path.join(directory, name) for name in subdirectories)
+
+            # Forget removed directories and everything outside root
+            with self.cache.transaction() as connection:
+                for directory in known.keys() - visited:
+                    self._remove_directory(connection, directory)
+
+        return probed
+
+    def random_images(
+        self, orientation: str, count: int = 1, query: str = "", root: str = ""
+    ) -> list[dict]:
+        """Returns up to count random images of the orientation matching the query."""
+        with self.cache.transaction() as connection:
+            if query:
+                # Query words must all appear in the path, this scans the index
+                # Folder names above root would match every image
+                start = (
+                    len(os.path.abspath(os.path.expanduser(root))) + 2 if root else 1
+                )
+                conditions = ""
+                parameters = [orientation]
+                for word in query.lower().split():
+                    # Words are matched literally, not as LIKE wildcards
+                    for char in "\\%_":
+                        word = word.replace(char, f"\\{char}")
+                    conditions += " AND LOWER(SUBSTR(path, ?)) LIKE ? ESCAPE '\\'"
+                    parameters += [start, f"%{word}%"]
+
+                rows = connection.execute(
+                    "SELECT path, size, mtime, width, height FROM local_images"
+                    f" WHERE orientation = ?{conditions} ORDER BY RANDOM() LIMIT ?",
+                    (*parameters, count),
+                ).fetchall()
+            else:
+                (total,) = connection.execute(
+                    "SELECT COALESCE(MAX(position), -1) + 1 FROM local_images"
+                    " WHERE orientation = ?",
+                    (orientation,),
+                ).fetchone()
+                positions = random.sample(range(total), min(count, total))
+                rows = connection.execute(
+                    "SELECT path, size, mtime, width, height FROM local_images"
+                    " WHERE orientation = ? AND position IN"
+                    f" ({', '.join('?' * len(positions))})",
+                    (orientation, *positions),
+                ).fetchall()
+
+        return [
+            {
+                "path": path,
+                "size": size,
+                "mtime": mtime,
+                "width": width,
+                "height": height,
+                "orientation": orientation,
+            }
+            for path, size, mtime, width, height in rows
+        ]
+
+    def refresh(self, path: str) -> dict | None:
+        """Reads header of the image again. Returns the image, None if it is gone."""
+        try:
+            stat = os.stat(path)
+            header = imageinfo.probe_image_file(path)
+        except OSError:
+            self.remove(path)
+            return None
+
+        _, width, height = header or (None, 0, 0)
+        with self.cache.transaction() as connection:
+            self._remove_image(connection, path)
+            self._add_image(
+                connection,
+                path,
+                os.path.dirname(path),
+                stat.st_size,
+                stat.st_mtime_ns,
+                width,
+                height,
+            )
+
+        return {
+            "path": path,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime_ns,
+            "width": width,
+            "height": height,
+            "orientation": image_orientation(width, height),
+        }
+
+    def remove(self, path: str) -> None:
+        """Forgets image, e.g. when its file was found missing."""
+        with self.cache.transaction() as connection:
+            self._remove_image(connection, path)
+
+    def _scan_directory(
+        self, directory: str
+    ) -> tuple[list[str], list[tuple[str, int, int, int, int]], set[str]]:
+        """Returns subdirectories, new or changed images and removed image paths."""
+        with self.cache.transaction() as connection:
+            indexed = {
+                path: (size, mtime)
+                for path, size, mtime in connection.execute(
+                    "SELECT path, size, mtime FROM local_images WHERE directory = ?",
+                    (directory,),
+                )
+            }
+        subdirectories = []
+        changed = []
+        present = set()
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                # Symlinked directories are skipped to avoid loops
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.name)
+                    continue
+                if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                present.add(entry.path)
+
+                if indexed.get(entry.path) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+
+                try:
+                    header = imageinfo.probe_image_file(entry.path)
+                except OSError:
+                    header = None
+
+                # Unreadable images are kept as unknown so they are not probed again
+                _, width, height = header or (None, 0, 0)
+                changed.append(
+                    (entry.path, stat.st_size, stat.st_mtime_ns, width, height)
+                )
+
+        return subdirectories, changed, indexed.keys() - present
+
+    def _add_image(
+        self,
+        connection,
+        path: str,
+        directory: str,
+        size: int,
+        mtime: int,
+        width: int,
+        height: int,
+    ) -> None:
+        orientation = image_orientation(width, height)
+        (position,) = connection.execute(
+            "SELECT COALESCE(MAX(position), -1) + 1 FROM local_images"
+            " WHERE orientation = ?",
+            (orientation,),
+        ).fetchone()
+
+        connection.execute(
+            "INSERT INTO local_images"
+            " (path, directory, size, mtime, width, height, orientation, position)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, directory, size, mtime, width, height, orientation, position),
+        )
+
+    def _remove_image(self, connection, path: str) -> None:
+        row = connection.execute(
+            "SELECT orientation, position FROM local_images WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None:
+            return
+
+        orientation, position = row
+        connection.execute("DELETE FROM local_images WHERE path = ?", (path,))
+
+        # Move the last image of the orientation into the gap
+        connection.execute(
+            "UPDATE local_images SET position = ?"
+            " WHERE orientation = ? AND position = ("
+            " SELECT MAX(position) FROM local_images WHERE orientation = ?)"
+            " AND position > ?",
+            (position, orientation, orientation, position),
+        )
+
+    def _remove_directory(self, connection, directory: str) -> None:
+        paths = connection.execute(
+            "SELECT path FROM local_images WHERE directory = ?", (directory,)
+        ).fetchall()
+        for (path,) in paths:
+            self._remove_image(connection, path)
+
+        connection.execute("DELETE FROM local_directories WHERE path = ?", (directory,))
@@ -0,0 +1,173 @@
+import math
+import os
+from abc import ABC, abstractmethod
+
+
+class Provider(ABC):
+    """Source of image results, dicts with "url", "thumbnail" and "api"."""
+
+    # Results are served once if True, otherwise result pages are reused
+    consumable = False
+    # Default request budget and its window in seconds
+    rate_limit = (0, 0)
+
+    def __init__(self, name: str, program_data):
+        self.name = name
+        self.program_data = program_data
+        self.api_config = program_data.apis.get(name)
+
+        if not self.api_config:
+            raise ValueError(f"No API config found for '{name}'")
+
+    def is_configured(self) -> bool:
+        """Returns True if provider can be used with the current config."""
+        return True
+
+    @abstractmethod
+    def parse_results(self, data, resolution: tuple[int, int] | None) -> list[dict]:
+        """Returns results from the provider data."""
+
+
+class RemoteProvider(Provider):
+    """Image search API, its requests are sent by core."""
+
+    @abstractmethod
+    def search_url(
+        self, query: str, count: int, resolution: tuple[int, int] | None
+    ) -> str:
+        """Returns URL of the search request."""
+
+    @abstractmethod
+    def parse_results(self, data, resolution: tuple[int, int] | None) -> list[dict]:
+        """Returns results with "tags", "colors" and "resolution" if reported."""
+
+
+class UnsplashProvider(RemoteProvider):
+    consumable = True
+    rate_limit = (50, 3600)
+    # Maximum number of photos returned by a single random request
+    max_count = 30
+
+    def is_configured(self) -> bool:
+        return bool(self.api_config.get("api_token"))
+
+    def search_url(self, query, count, resolution):
+        url = (
+            f"{self.api_config['api_url']}?client_id={self.api_config['api_token']}"
+            f"&orientation={self.program_data.image.get('orientation')}&query={query}"
+        )
+
+        # Unsplash returns a list of photos if count is given
+        if count > 1:
+            url += f"&count={min(count, self.max_count)}"
+
+        return url
+
+    def parse_results(self, data, resolution):
+        photos = data if isinstance(data, list) else [data]
+        return [self.parse_photo(photo, resolution) for photo in photos]
+
+    def parse_photo(self, photo: dict, resolution: tuple[int, int] | None) -> dict:
+        """Returns result describing the photo."""
+        tags = [tag["title"] for tag in photo.get("tags", []) if "title" in tag]
+        if photo.get("alt_description"):
+            tags.append(photo["alt_description"])
+
+        width, height = photo.get("width"), photo.get("height")
+        return {
+            "url": self.sized_url(photo, resolution),
+            "thumbnail": photo.get("urls", {}).get("small"),
+            "api": self.name,
+            "tags": tags,
+            "colors": [photo["color"]] if photo.get("color") else [],
+            "resolution": f"{width}x{height}" if width and height else None,
+        }
+
+    def sized_url(self, photo: dict, resolution: tuple[int, int] | None) -> str:
+        """Returns URL of the photo resized to cover target resolution."""
+        urls = photo.get("urls", {})
+        width, height = photo.get("width"), photo.get("height")
+
+        if not resolution or not width or not height or not urls.get("raw"):
+            return urls.get("full")
+
+        # Scale factor needed for the photo to cover the whole target area
+        scale = max(resolution[0] / width, resolution[1] / height)
+        if scale >= 1:
+            return urls.get("full")
+
+        separator = "&" if "?" in urls["raw"] else "?"
+        return (
+            f"{urls['raw']}{separator}w={math.ceil(width * scale)}"
+            f"&h={math.ceil(height * scale)}&fit=max"
+            f"&q={self.program_data.image.get('quality', 85)}&fm=jpg"
+        )
+
+
+class WallhavenProvider(RemoteProvider):
+    rate_limit = (45, 60)
+
+    def search_url(self, query, count, resolution):
+        orientation = self.program_data.image.get("orientation")
+        ratio = self.program_data.orientation_ratios.get(orientation)
+        if not ratio:
+            raise ValueError(f"No ratio found for orientation '{orientation}'")
+
+        url = (
+            f"{self.api_config['api_url']}?apikey={self.api_config['api_token']}"
+            f"&ratios={ratio}&q={query}"
+            f"&purity={self.program_data.image.get('purity')}"
+        )
+
+        # Skip images too small to cover the target resolution
+        if resolution:
+            url += f"&atleast={resolution[0]}x{resolution[1]}"
+
+        return url
+
+    def parse_results(self, data, resolution):
+        data = data.get("data", [])
+        if not data:
+            raise ValueError("No image data returned from Wallhaven")
+
+        return [self.parse_item(item) for item in data]
+
+    def parse_item(self, item: dict) -> dict:
+        """Returns result describing the wallpaper."""
+        # Search lists tags only for some items, category is always there
+        tags = [tag["name"] for tag in item.get("tags", []) if "name" in tag]
+        if item.get("category"):
+            tags.append(item["category"])
+
+        return {
+            "url": item["path"],
+            "thumbnail": item.get("thumbs", {}).get("large"),
+            "api": self.name,
+            "tags": tags,
+            "colors": item.get("colors", []),
+            "resolution": item.get("resolution"),
+        }
+
+
+class LocalProvider(Provider):
+    """Images from a local folder picked from its index, see localindex."""
+
+    @property
+    def directory(self) -> str:
+        return os.path.expanduser(self.api_config.get("directory", ""))
+
+    def is_configured(self) -> bool:
+        return os.path.isdir(self.directory)
+
+    def parse_results(self, data, resolution):
+        return [
+            {"url": f"file://{image['path']}", "thumbnail": None, "api": self.name}
+            for image in data
+        ]
+
+
+PROVIDERS = {
+    "unsplash": UnsplashProvider,
+    "wallhaven": WallhavenProvider,
+    "local": LocalProvider,
+}
@@ -0,0 +1,71 @@
+"""Measures import time of core and checks it stays free of side effects.
+
+Run from the repository root:
+
+    python benchmarks/import_time.py
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+# Modules core must not import
+DEFERRED_MODULES = ("requests", "urllib3", "PyQt6", "sqlite3", "subprocess")
+
+
+def import_times(module: str, env: dict) -> dict[str, int]:
+    """Returns cumulative import time in microseconds of every loaded module."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=APP_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # Lines look like "import time:  self [us] | cumulative | imported package"
+    times = {}
+    for line in process.stderr.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            times[fields[2].strip()] = int(fields[1])
+
+    return times
+
+
+def main(runs: int = 10) -> int:
+    # Compile sources first so bytecode compilation is not measured
+    subprocess.run([sys.executable, "-m", "compileall", "-q", APP_DIR], check=True)
+
+    with tempfile.TemporaryDirectory() as home:
+        env = dict(os.environ, HOME=home)
+
+        timings = []
+        for _ in range(runs):
+            times = import_times("core", env)
+            timings.append(times["core"])
+
+        created = [
+            os.path.join(root, name)
+            for root, _, names in os.walk(home)
+            for name in names
+        ]
+
+    print(f"core import: {statistics.median(timings) / 1000:.1f} ms")
+
+    failures = [f"core imports {name}" for name in DEFERRED_MODULES if name in times]
+    failures += [f"core import created {path}" for path in created]
+
+    for failure in failures:
+        print(failure, file=sys.stderr)
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
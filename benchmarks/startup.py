@@ -0,0 +1,90 @@
+"""Compares process startup cost of headless and GUI modes, network excluded.
+
+Run from the repository root:
+
+    python benchmarks/startup.py
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+HEADLESS = """
+import sys
+import main, core
+main.parse_args(["--once"])
+core.init()
+assert "PyQt6" not in sys.modules, "headless mode imported PyQt6"
+"""
+
+# Qt must stay unloaded until an image is actually downscaled
+HEADLESS_DOWNSCALE = """
+import shutil, sys
+import imageinfo, main, core
+main.parse_args(["--once"])
+core.init()
+core.program_data.image.update(downscale=True, max_resolution="640x360")
+assert "PyQt6" not in sys.modules, "downscale setting imported PyQt6 at startup"
+shutil.copy(sys.argv[1], sys.argv[2])
+core.downscale_image(sys.argv[2])
+assert imageinfo.probe_image_file(sys.argv[2])[1:] == (640, 360), "not downscaled"
+"""
+
+GUI = """
+import main, core
+import gui
+core.init()
+app = gui.QApplication([])
+window = gui.WallpaperED(program_data=core.program_data)
+"""
+
+IMAGE = """
+import sys
+from PyQt6.QtGui import QImage
+image = QImage(1920, 1080, QImage.Format.Format_RGB32)
+image.fill(0x336699)
+image.save(sys.argv[1], "JPG")
+"""
+
+
+def measure(code: str, env: dict, runs: int, *args: str) -> float:
+    """Returns median wall time of running code in a fresh interpreter."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", code, *args], cwd=APP_DIR, env=env, check=True
+        )
+        timings.append(time.perf_counter() - start)
+
+    return statistics.median(timings)
+
+
+def main(runs: int = 10) -> None:
+    with tempfile.TemporaryDirectory() as home:
+        # Keep user config and cache untouched
+        os.makedirs(os.path.join(home, ".config", "wallpaper-ed"))
+        env = dict(os.environ, HOME=home, QT_QPA_PLATFORM="offscreen")
+
+        source = os.path.join(home, "source.jpg")
+        subprocess.run([sys.executable, "-c", IMAGE, source], env=env, check=True)
+
+        headless = measure(HEADLESS, env, runs)
+        downscale = measure(
+            HEADLESS_DOWNSCALE, env, runs, source, os.path.join(home, "image.jpg")
+        )
+        gui = measure(GUI, env, runs)
+
+    print(f"headless startup: {headless * 1000:.1f} ms")
+    print(f"with downscale:   {downscale * 1000:.1f} ms")
+    print(f"gui startup:      {gui * 1000:.1f} ms")
+    print(f"saved at login:   {(gui - headless) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+import itertools
+
+import pytest
+
+import cache as cache_module
+from cache import ImageCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    # Every use gets a later time so recency does not depend on the clock
+    clock = itertools.count(1)
+    monkeypatch.setattr(cache_module.time, "time", lambda: next(clock))
+    return ImageCache(str(tmp_path / "cache.sqlite3"))
+
+
+def add_image(cache, tmp_path, name, size=10, metadata=None):
+    path = tmp_path / f"{name}.jpg"
+    path.write_bytes(b"\0" * size)
+    cache.add(f"https://{name}", str(path), name, metadata)
+    return str(path)
+
+
+def test_lookup_forgets_missing_files(cache, tmp_path):
+    path = add_image(cache, tmp_path, "a")
+    assert cache.lookup("https://a") == path
+
+    (tmp_path / "a.jpg").unlink()
+
+    assert cache.lookup("https://a") is None
+    assert cache.find_images("") == []
+
+
+def test_find_images_ranks_by_matched_words(cache, tmp_path):
+    add_image(cache, tmp_path, "a", metadata={"query": "mountains", "tags": ["lake"]})
+    add_image(cache, tmp_path, "b", metadata={"query": "mountain lake"})
+    add_image(cache, tmp_path, "c", metadata={"query": "city"})
+
+    found = [
+        (url, matched) for url, _, _, matched in cache.find_images("Lake mountains")
+    ]
+
+    assert found == [("https://a", 2), ("https://b", 1)]
+
+
+def test_evict_removes_least_recently_used(cache, tmp_path):
+    a, b, c, d, e = (add_image(cache, tmp_path, name) for name in "abcde")
+    cache.touch(a)
+    cache.set_state("current_wallpaper", b)
+
+    cache.evict(max_bytes=30, max_files=0, keep={c})
+
+    assert sorted(path for _, path, _, _ in cache.find_images("")) == [a, b, c]
+    assert not (tmp_path / "d.jpg").exists()
+
+
+def test_evict_limits_number_of_files(cache, tmp_path):
+    paths = [add_image(cache, tmp_path, name) for name in "abc"]
+
+    cache.evict(max_bytes=0, max_files=1)
+
+    assert [path for _, path, _, _ in cache.find_images("")] == paths[2:]
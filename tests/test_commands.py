@@ -0,0 +1,85 @@
+import pytest
+
+import commands
+
+FILE_NAMES = [
+    "plain.jpg",
+    "with space.jpg",
+    'quo"te.jpg',
+    "it's.jpg",
+    "a$(touch x).jpg",
+]
+
+
+@pytest.mark.parametrize("name", FILE_NAMES)
+def test_path_is_one_argument_without_shell(name):
+    assert commands.expand_command('feh --bg-fill "%PATH%"', name) == [
+        "feh",
+        "--bg-fill",
+        name,
+    ]
+
+
+@pytest.mark.parametrize("name", FILE_NAMES)
+@pytest.mark.parametrize(
+    "template, expected",
+    [
+        ("cp %PATH% copy.jpg && echo done", "copy.jpg"),
+        ('echo "file://%PATH%" > out.txt', "out.txt"),
+        ("echo 'file://%PATH%' > out.txt", "out.txt"),
+    ],
+    ids=["unquoted", "double-quoted", "single-quoted"],
+)
+def test_shell_command_gets_path_quoted(
+    tmp_path, monkeypatch, name, template, expected
+):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / name
+    path.write_text("image")
+
+    (result,) = commands.run_commands([template], str(path), timeout=5)
+
+    assert result.ok, result.stderr
+    assert not (tmp_path / "x").exists()
+    if expected == "out.txt":
+        assert (tmp_path / expected).read_text() == f"file://{path}\n"
+    else:
+        assert (tmp_path / expected).read_text() == "image"
+
+
+@pytest.mark.parametrize("name", FILE_NAMES)
+def test_command_runs_with_any_file_name(tmp_path, monkeypatch, name):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / name
+
+    (result,) = commands.run_commands(["touch %PATH%"], str(path), timeout=5)
+
+    assert result.ok, result.stderr
+    assert path.exists()
+    assert not (tmp_path / "x").exists()
+
+
+def test_invalid_template_fails_without_raising():
+    (result,) = commands.run_commands(['feh "%PATH%'], "a.jpg", timeout=5)
+
+    assert not result.ok
+
+
+def test_gsettings_path_with_quotes_does_not_raise():
+    template = 'gsettings set org.gnome.desktop.background picture-uri "file://%PATH%"'
+
+    commands.apply_gsettings([template], 'quo"te.jpg')
+
+
+def test_commands_run_in_order_by_default(tmp_path):
+    path = tmp_path / "image.jpg"
+    path.write_text("image")
+    copy = tmp_path / "copy.jpg"
+
+    results = commands.run_commands(
+        [f"sh -c 'sleep 0.2; cp \"$0\" {copy}' %PATH%", f"test -f {copy}"],
+        str(path),
+        timeout=5,
+    )
+
+    assert all(result.ok for result in results)
@@ -0,0 +1,142 @@
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import core
+from config import AppConfig
+
+
+@pytest.fixture
+def program_data(tmp_path, monkeypatch):
+    # Config, cache and downloads live in a temporary home
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setattr(core, "_cache", None)
+    monkeypatch.setattr(core, "screen_resolution", None)
+    monkeypatch.setattr(core, "program_data", core.program_data)
+    yield core.init(AppConfig())
+    if core._cache is not None:
+        core._cache._connection.close()
+
+
+def test_target_resolution_is_not_limited_by_default(program_data):
+    assert core.target_resolution() is None
+
+
+def test_headless_run_uses_resolution_seen_by_gui(program_data, monkeypatch):
+    core.set_screen_resolution(2560, 1440)
+    # Next process starts without the GUI
+    monkeypatch.setattr(core, "screen_resolution", None)
+
+    assert core.target_resolution() == (2560, 1440)
+
+    program_data.image["orientation"] = "portrait"
+    assert core.target_resolution() == (1440, 2560)
+
+
+def test_max_resolution_wins_over_screen(program_data):
+    core.set_screen_resolution(2560, 1440)
+    program_data.image["max_resolution"] = "1920x1080"
+
+    assert core.target_resolution() == (1920, 1080)
+
+
+def png_image(width, height, size=4096):
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    header = b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + ihdr
+    return header + b"\0" * (size - len(header))
+
+
+class FakeResponse:
+    def __init__(self, body, status_code=200):
+        self.body = body
+        self.status_code = status_code
+        self.headers = {"Content-Length": str(len(body))}
+        self.chunks_read = 0
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.body), chunk_size):
+            self.chunks_read += 1
+            yield self.body[start : start + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+@pytest.mark.parametrize(
+    "options, size, probed",
+    [
+        ({"max_bytes": 1000}, 1001, None),
+        ({"min_resolution": "1920x1080"}, 0, ("jpeg", 1280, 1080)),
+        ({"aspect_tolerance": 0.05}, 0, ("jpeg", 1080, 1920)),
+    ],
+    ids=["too-large", "too-small", "wrong-aspect"],
+)
+def test_check_image_suitable_rejects(program_data, options, size, probed):
+    program_data.image.update(options)
+
+    with pytest.raises(core.UnsuitableImageError):
+        core.check_image_suitable(size, probed)
+
+
+@pytest.mark.parametrize(
+    "size, probed",
+    [(1000, None), (0, ("jpeg", 2560, 1440)), (0, ("png", 2160, 1440))],
+)
+def test_check_image_suitable_accepts(program_data, size, probed):
+    program_data.image.update(
+        max_bytes=1000, min_resolution="1920x1080", aspect_tolerance=0.05
+    )
+
+    core.check_image_suitable(size, probed)
+
+
+def test_limits_are_disabled_by_default(program_data):
+    core.check_image_suitable(10**9, ("jpeg", 10, 1000))
+
+
+def test_download_stops_after_unsuitable_header(program_data, tmp_path, monkeypatch):
+    program_data.download_directory = str(tmp_path / "downloads")
+    program_data.image["min_resolution"] = "1920x1080"
+    response = FakeResponse(png_image(640, 480, size=64 * 1024))
+    monkeypatch.setattr(core, "http_get", lambda url, **kwargs: response)
+
+    with pytest.raises(core.UnsuitableImageError):
+        core.download_image("https://images/small.png", chunk_size=1024)
+
+    # Only the header was read and no partial file is left behind
+    assert response.chunks_read == 1
+    assert os.listdir(tmp_path / "downloads") == []
+
+
+def test_download_keeps_suitable_image(program_data, tmp_path, monkeypatch):
+    program_data.download_directory = str(tmp_path / "downloads")
+    program_data.image["min_resolution"] = "1920x1080"
+    body = png_image(2560, 1440)
+    monkeypatch.setattr(core, "http_get", lambda url, **kwargs: FakeResponse(body))
+
+    path = core.download_image("https://images/large.png", chunk_size=1024)
+
+    with open(path, "rb") as image_file:
+        assert image_file.read() == body
+    assert os.listdir(tmp_path / "downloads") == [os.path.basename(path)]
+
+
+def test_request_context_reaches_pool_threads():
+    def is_background():
+        return getattr(core._request_context, "background", False)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with core.background_requests():
+            background = executor.submit(core.in_request_context(is_background))
+        interactive = executor.submit(core.in_request_context(is_background))
+        # Pool thread is left as it was after each call
+        after = executor.submit(is_background)
+
+        assert background.result() is True
+        assert interactive.result() is False
+        assert after.result() is False
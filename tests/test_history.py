@@ -0,0 +1,76 @@
+from history import PreviewHistory
+
+
+def test_back_and_forward():
+    history = PreviewHistory(max_bytes=100)
+    for name in "abc":
+        history.push(f"https://{name}", f"/{name}.jpg")
+
+    assert history.back() == ("https://b", "/b.jpg")
+    assert history.back() == ("https://a", "/a.jpg")
+    assert history.back() is None
+    assert history.forward() == ("https://b", "/b.jpg")
+    assert history.can_go_forward()
+
+
+def test_push_drops_forward_entries_and_their_previews():
+    history = PreviewHistory(max_bytes=100)
+    for name in "abc":
+        history.push(f"https://{name}", f"/{name}.jpg")
+        history.store_preview(f"/{name}.jpg", name, 10)
+    history.back()
+    history.back()
+
+    history.push("https://d", "/d.jpg")
+
+    assert history.entries == [("https://a", "/a.jpg"), ("https://d", "/d.jpg")]
+    assert not history.can_go_forward()
+    assert history.preview("/b.jpg") is None
+    assert history.preview("/c.jpg") is None
+    assert history.preview_bytes == 10
+
+
+def test_oldest_entries_are_dropped():
+    history = PreviewHistory(max_bytes=100, max_entries=2)
+    for name in "abc":
+        history.push(f"https://{name}", f"/{name}.jpg")
+
+    assert [path for _, path in history.entries] == ["/b.jpg", "/c.jpg"]
+    assert history.current() == ("https://c", "/c.jpg")
+
+
+def test_previews_are_evicted_least_recently_used_first():
+    history = PreviewHistory(max_bytes=30)
+    for name in "abc":
+        history.store_preview(f"/{name}.jpg", name, 10)
+
+    # Reading a preview makes it the most recently used one
+    assert history.preview("/a.jpg") == "a"
+    history.store_preview("/d.jpg", "d", 10)
+
+    assert history.preview("/b.jpg") is None
+    assert [history.preview(f"/{name}.jpg") for name in "acd"] == ["a", "c", "d"]
+    assert history.preview_bytes == 30
+
+
+def test_preview_larger_than_budget_is_not_cached():
+    history = PreviewHistory(max_bytes=30)
+    history.store_preview("/a.jpg", "a", 10)
+
+    history.store_preview("/b.jpg", "b", 31)
+
+    assert history.preview("/b.jpg") is None
+    assert history.preview("/a.jpg") == "a"
+    assert history.preview_bytes == 10
+
+
+def test_remove_current_forgets_preview():
+    history = PreviewHistory(max_bytes=100)
+    history.push("https://a", "/a.jpg")
+    history.push("https://b", "/b.jpg")
+    history.store_preview("/b.jpg", "b", 10)
+
+    history.remove_current()
+
+    assert history.current() == ("https://a", "/a.jpg")
+    assert history.preview_bytes == 0
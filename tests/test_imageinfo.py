@@ -0,0 +1,97 @@
+import struct
+
+import pytest
+
+import imageinfo
+
+
+def png_header(width, height):
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + ihdr
+
+
+def jpeg_header(width, height, marker=0xC0, app_size=16):
+    app0 = b"\xff\xe0" + struct.pack(">H", app_size) + b"\0" * (app_size - 2)
+    sof = b"\xff" + bytes([marker]) + struct.pack(">HBHH", 17, 8, height, width)
+    return b"\xff\xd8" + app0 + sof + b"\x03\x01\x22\x00"
+
+
+def webp_lossy(width, height):
+    frame = b"\0\0\0" + b"\x9d\x01\x2a" + struct.pack("<HH", width, height)
+    return b"RIFF\0\0\0\0WEBPVP8 " + struct.pack("<I", len(frame)) + frame
+
+
+def webp_lossless(width, height):
+    bits = (width - 1) | (height - 1) << 14
+    return b"RIFF\0\0\0\0WEBPVP8L\0\0\0\0\x2f" + bits.to_bytes(4, "little")
+
+
+def webp_extended(width, height):
+    canvas = (width - 1).to_bytes(3, "little") + (height - 1).to_bytes(3, "little")
+    return b"RIFF\0\0\0\0WEBPVP8X\x0a\0\0\0\0\0\0\0" + canvas
+
+
+@pytest.mark.parametrize(
+    "data, expected",
+    [
+        (png_header(1920, 1080), ("png", 1920, 1080)),
+        (jpeg_header(3840, 2160), ("jpeg", 3840, 2160)),
+        (jpeg_header(800, 600, marker=0xC2), ("jpeg", 800, 600)),
+        (webp_lossy(1024, 768), ("webp", 1024, 768)),
+        (webp_lossless(16383, 1), ("webp", 16383, 1)),
+        (webp_extended(20000, 10000), ("webp", 20000, 10000)),
+    ],
+    ids=[
+        "png",
+        "jpeg",
+        "jpeg-progressive",
+        "webp-lossy",
+        "webp-lossless",
+        "webp-extended",
+    ],
+)
+def test_probe_image_size(data, expected):
+    assert imageinfo.probe_image_size(data) == expected
+
+
+@pytest.mark.parametrize(
+    "data, dimensions_end",
+    [
+        (png_header(1920, 1080), 24),
+        (jpeg_header(3840, 2160), 29),
+        (webp_lossy(1024, 768), 30),
+        (webp_lossless(640, 480), 25),
+        (webp_extended(640, 480), 30),
+    ],
+    ids=["png", "jpeg", "webp-lossy", "webp-lossless", "webp-extended"],
+)
+def test_truncated_header_returns_none(data, dimensions_end):
+    expected = imageinfo.probe_image_size(data)
+
+    for length in range(len(data)):
+        probed = imageinfo.probe_image_size(data[:length])
+        assert probed == (expected if length >= dimensions_end else None)
+
+
+def test_jpeg_fill_bytes_and_standalone_markers_are_skipped():
+    header = jpeg_header(640, 480)
+    data = header[:2] + b"\xff\xff\xff\xd0" + header[2:]
+
+    assert imageinfo.probe_image_size(data) == ("jpeg", 640, 480)
+
+
+def test_corrupt_jpeg_returns_none():
+    assert imageinfo.probe_image_size(b"\xff\xd8\x00\x00\x00\x00") is None
+
+
+def test_unknown_format_returns_none():
+    assert imageinfo.probe_image_size(b"GIF89a" + b"\0" * 32) is None
+
+
+def test_probe_image_file_reads_past_first_block(tmp_path):
+    path = tmp_path / "large_exif.jpg"
+    # Metadata segment pushes the frame header past the first read
+    path.write_bytes(jpeg_header(1920, 1080, app_size=60000) + b"\0" * 1024)
+
+    assert imageinfo.probe_image_file(str(path)) == ("jpeg", 1920, 1080)
+    assert imageinfo.probe_image_file(str(path), limit=32 * 1024) is None
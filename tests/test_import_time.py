@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "app")
+
+# Modules core must not import, also measured by benchmarks/import_time.py
+DEFERRED_MODULES = ("requests", "urllib3", "PyQt6", "sqlite3", "subprocess")
+
+
+@pytest.fixture(scope="module")
+def core_import(tmp_path_factory):
+    """Returns modules imported by core and files created in a fresh home."""
+    home = tmp_path_factory.mktemp("home")
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import core"],
+        cwd=APP_DIR,
+        env=dict(os.environ, HOME=str(home)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # Lines look like "import time:  self [us] | cumulative | imported package"
+    modules = set()
+    for line in process.stderr.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            modules.add(fields[2].strip())
+
+    created = [
+        os.path.join(root, name) for root, _, names in os.walk(home) for name in names
+    ]
+    return modules, created
+
+
+@pytest.mark.parametrize("module", DEFERRED_MODULES)
+def test_core_defers_heavy_imports(core_import, module):
+    modules, _ = core_import
+
+    assert "core" in modules
+    assert module not in modules
+
+
+def test_core_import_creates_no_files(core_import):
+    _, created = core_import
+
+    assert created == []
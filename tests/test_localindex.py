@@ -0,0 +1,152 @@
+import os
+import struct
+
+import pytest
+
+from cache import ImageCache
+from localindex import LocalImageIndex, image_orientation
+
+
+def write_png(path, width, height):
+    ihdr = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    path.write_bytes(b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + ihdr)
+
+
+def positions(index, orientation):
+    with index.cache.transaction() as connection:
+        return sorted(
+            position
+            for (position,) in connection.execute(
+                "SELECT position FROM local_images WHERE orientation = ?",
+                (orientation,),
+            )
+        )
+
+
+@pytest.fixture
+def folder(tmp_path):
+    folder = tmp_path / "pictures"
+    (folder / "nested").mkdir(parents=True)
+    for i in range(5):
+        write_png(folder / f"wide{i}.png", 1920, 1080)
+    for i in range(3):
+        write_png(folder / "nested" / f"tall{i}.png", 1080, 1920)
+    (folder / "notes.txt").write_text("not an image")
+    return folder
+
+
+@pytest.fixture
+def index(tmp_path):
+    return LocalImageIndex(ImageCache(str(tmp_path / "cache.sqlite3")))
+
+
+def touch_directory(directory):
+    # Directory mtime has to change for a rescan to list it again
+    stat = os.stat(directory)
+    os.utime(directory, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+@pytest.mark.parametrize(
+    "width, height, expected",
+    [
+        (1920, 1080, "landscape"),
+        (1080, 1920, "portrait"),
+        (1000, 1000, "squarish"),
+        (0, 0, "unknown"),
+    ],
+)
+def test_image_orientation(width, height, expected):
+    assert image_orientation(width, height) == expected
+
+
+def test_update_indexes_images_by_orientation(folder, index):
+    assert index.update(str(folder)) == 8
+
+    assert positions(index, "landscape") == list(range(5))
+    assert positions(index, "portrait") == list(range(3))
+    assert len(index.random_images("landscape", count=10)) == 5
+
+
+def test_update_skips_unchanged_directories(folder, index):
+    index.update(str(folder))
+
+    assert index.update(str(folder)) == 0
+
+
+def test_remove_fills_gap_with_last_image(folder, index):
+    index.update(str(folder))
+
+    index.remove(str(folder / "wide1.png"))
+    index.remove(str(folder / "wide4.png"))
+
+    assert positions(index, "landscape") == list(range(3))
+    paths = {image["path"] for image in index.random_images("landscape", count=10)}
+    assert paths == {str(folder / f"wide{i}.png") for i in (0, 2, 3)}
+
+
+def test_rescan_drops_removed_and_adds_new_images(folder, index):
+    index.update(str(folder))
+
+    os.remove(folder / "wide0.png")
+    os.remove(folder / "nested" / "tall1.png")
+    write_png(folder / "nested" / "wide5.png", 1920, 1080)
+    touch_directory(folder)
+    touch_directory(folder / "nested")
+
+    assert index.update(str(folder)) == 1
+    assert positions(index, "landscape") == list(range(5))
+    assert positions(index, "portrait") == list(range(2))
+
+
+def test_rescan_forgets_removed_directory(folder, index):
+    index.update(str(folder))
+
+    for i in range(3):
+        os.remove(folder / "nested" / f"tall{i}.png")
+    os.rmdir(folder / "nested")
+    touch_directory(folder)
+
+    index.update(str(folder))
+    assert positions(index, "portrait") == []
+
+
+def test_refresh_moves_replaced_image(folder, index):
+    index.update(str(folder))
+    path = folder / "wide2.png"
+    write_png(path, 1080, 1920)
+
+    image = index.refresh(str(path))
+
+    assert image["orientation"] == "portrait"
+    assert positions(index, "landscape") == list(range(4))
+    assert positions(index, "portrait") == list(range(4))
+
+
+def test_random_images_filters_by_query(folder, index):
+    index.update(str(folder))
+
+    images = index.random_images(
+        "portrait", count=10, query="NESTED tall1", root=str(folder)
+    )
+
+    assert [image["path"] for image in images] == [str(folder / "nested" / "tall1.png")]
+
+
+def test_query_ignores_folders_above_root(folder, index):
+    index.update(str(folder))
+
+    assert index.random_images("landscape", count=10, query="pictures") != []
+    assert (
+        index.random_images("landscape", count=10, query="pictures", root=str(folder))
+        == []
+    )
+
+
+@pytest.mark.parametrize("query", ["_", "%", "wide_"])
+def test_query_matches_wildcards_literally(folder, index, query):
+    write_png(folder / "wide_%.png", 1920, 1080)
+    index.update(str(folder))
+
+    images = index.random_images("landscape", count=10, query=query, root=str(folder))
+
+    assert [image["path"] for image in images] == [str(folder / "wide_%.png")]